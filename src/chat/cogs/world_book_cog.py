@@ -9,12 +9,18 @@ import json
 import re
 from datetime import datetime
 import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict
 
 from src import config
 from src.chat.config import chat_config
 from src.chat.features.world_book.services.incremental_rag_service import incremental_rag_service
+from src.chat.features.world_book.database.world_book_db_manager import world_book_db_manager
+from src.chat.features.world_book.services.world_book_service import world_book_service
 from src.chat.features.personal_memory.services.personal_memory_service import personal_memory_service
 from src.chat.features.odysseia_coin.service.coin_service import coin_service
+from src.chat.utils.sqlite_pool import get_pool
 
 log = logging.getLogger(__name__)
 
@@ -22,6 +28,16 @@ log = logging.getLogger(__name__)
 REVIEW_SETTINGS = chat_config.WORLD_BOOK_CONFIG['review_settings']
 VOTE_EMOJI = REVIEW_SETTINGS['vote_emoji']
 REJECT_EMOJI = REVIEW_SETTINGS['reject_emoji']
+# 所有审核类型用到的投票表情，用于在访问 Discord API 之前快速过滤无关反应
+_PROFILE_REVIEW_SETTINGS = chat_config.WORLD_BOOK_CONFIG.get('personal_profile_review_settings', REVIEW_SETTINGS)
+REVIEW_EMOJIS = frozenset({
+    VOTE_EMOJI,
+    REJECT_EMOJI,
+    _PROFILE_REVIEW_SETTINGS['vote_emoji'],
+    _PROFILE_REVIEW_SETTINGS['reject_emoji'],
+})
+# 审核消息 footer 中的审核ID，footer 格式由机器人自己生成
+REVIEW_ID_PATTERN = re.compile(r"审核ID: (\d+)")
 
 
 class WorldBookCog(commands.Cog):
@@ -30,38 +46,83 @@ class WorldBookCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.db_path = os.path.join(config.DATA_DIR, 'world_book.sqlite3')
+        # 审核消息的本地计票缓存: {message_id: {pending_id, approvals, rejections, approvers, rejecters, 阈值...}}
+        # 首次处理某条审核消息时由 process_vote 写入，approvals/rejections 为校准时消息上的票数，
+        # approvers/rejecters 记录此后投票的用户（去重）；达到阈值时才重新拉取消息
+        self.review_votes: Dict[int, Dict[str, Any]] = {}
+        # 每条审核消息一把锁，使并发的投票事件串行处理，保证同一条目只会被批准或否决一次
+        self._vote_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
         self.check_expired_entries.start()
 
     def cog_unload(self):
         self.check_expired_entries.cancel()
 
-    def _get_db_connection(self):
-        """建立并返回一个新的 SQLite 数据库连接。"""
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个 SQLite 连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(self.db_path)
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            conn = pool.acquire()
         except sqlite3.Error as e:
             log.error(f"连接到世界书数据库失败: {e}", exc_info=True)
-            return None
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
 
     @commands.Cog.listener('on_raw_reaction_add')
     async def on_review_reaction(self, payload: discord.RawReactionActionEvent):
         """监听对审核消息的反应"""
+        # 只处理指定的投票表情，在任何其他检查和 API 请求之前过滤
+        if str(payload.emoji) not in REVIEW_EMOJIS:
+            return
+
         # 关键修复：从源头忽略机器人自己的反应事件
         if payload.user_id == self.bot.user.id:
             # log.debug(f"[REACTION_DEBUG] 忽略机器人自己的反应 (User ID: {payload.user_id})")
             return
 
-        # 只处理指定的投票表情
-        if str(payload.emoji) not in [VOTE_EMOJI, REJECT_EMOJI]:
+        # 审核消息都由机器人发送；事件中已携带消息作者时，可直接跳过对他人消息的反应，无需拉取消息
+        if payload.message_author_id is not None and payload.message_author_id != self.bot.user.id:
             return
 
-        # 确保我们能获取到 Member 对象，以便后续检查
         channel = self.bot.get_channel(payload.channel_id)
         if not isinstance(channel, discord.TextChannel):
             return
 
+        # 已知的审核消息：直接在本地计票，只有达到阈值时才需要拉取消息
+        votes = self.review_votes.get(payload.message_id)
+        if votes is not None:
+            emoji = str(payload.emoji)
+            if emoji == votes['vote_emoji']:
+                voters = votes['approvers']
+            elif emoji == votes['reject_emoji']:
+                voters = votes['rejecters']
+            else:
+                return
+            if payload.user_id in voters:
+                # 重复的反应事件（例如网关重连后重放），不重复计票
+                return
+            voters.add(payload.user_id)
+
+            approvals = votes['approvals'] + len(votes['approvers'])
+            rejections = votes['rejections'] + len(votes['rejecters'])
+            if (approvals < votes['instant_approval_threshold']
+                    and rejections < votes['rejection_threshold']):
+                log.debug(f"审核ID #{votes['pending_id']} 本地计票: ✅{approvals}, ❌{rejections}，未达到阈值。")
+                return
+
+            try:
+                message = await channel.fetch_message(payload.message_id)
+            except discord.NotFound:
+                log.warning(f"找不到消息 {payload.message_id}，可能已被删除。")
+                self.review_votes.pop(payload.message_id, None)
+                return
+            await self.process_vote(votes['pending_id'], message)
+            return
+
         try:
             message = await channel.fetch_message(payload.message_id)
         except discord.NotFound:
@@ -73,7 +134,7 @@ class WorldBookCog(commands.Cog):
 
         embed = message.embeds[0]
         # 移除对标题的检查，只依赖 footer 中的审核ID来识别消息
-        match = re.search(r"审核ID: (\d+)", embed.footer.text or "")
+        match = REVIEW_ID_PATTERN.search(embed.footer.text or "")
         if not match:
             return
 
@@ -81,6 +142,27 @@ class WorldBookCog(commands.Cog):
         log.debug(f"检测到对审核消息 (ID: {message.id}) 的投票，解析出 pending_id: {pending_id}，投票者: {payload.member.display_name}")
         await self.process_vote(pending_id, message)
 
+    @commands.Cog.listener('on_raw_reaction_remove')
+    async def on_review_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        """撤回投票时同步扣减本地计票"""
+        votes = self.review_votes.get(payload.message_id)
+        if votes is None:
+            return
+
+        emoji = str(payload.emoji)
+        if emoji == votes['vote_emoji']:
+            voters, base_key = votes['approvers'], 'approvals'
+        elif emoji == votes['reject_emoji']:
+            voters, base_key = votes['rejecters'], 'rejections'
+        else:
+            return
+
+        if payload.user_id in voters:
+            voters.discard(payload.user_id)
+        else:
+            # 校准之前投的票，只能从基础票数中扣减
+            votes[base_key] = max(0, votes[base_key] - 1)
+
     def _get_review_settings(self, entry_type: str) -> dict:
         """根据条目类型获取对应的审核配置"""
         if entry_type == 'personal_profile':
@@ -88,47 +170,67 @@ class WorldBookCog(commands.Cog):
         return REVIEW_SETTINGS
 
     async def process_vote(self, pending_id: int, message: discord.Message):
-        """处理投票逻辑，检查是否达到阈值"""
-        log.debug(f"--- 开始处理投票 for pending_id: {pending_id} ---")
-        conn = self._get_db_connection()
-        if not conn:
-            return
-
+        """处理投票逻辑，检查是否达到阈值；同一条审核消息的投票会串行处理"""
+        lock = self._vote_locks[message.id]
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM pending_entries WHERE id = ? AND status = 'pending'", (pending_id,))
-            entry = cursor.fetchone()
+            async with lock:
+                await self._process_vote(pending_id, message)
+        finally:
+            # 审核已结束（不再本地计票）时释放这条消息的锁
+            if not lock.locked() and message.id not in self.review_votes:
+                self._vote_locks.pop(message.id, None)
 
-            if not entry:
-                log.warning(f"在 process_vote 中找不到待审核的条目 #{pending_id} 或其状态不是 'pending'。")
+    async def _process_vote(self, pending_id: int, message: discord.Message):
+        """在持有消息锁的情况下读取条目与票数，并在达到阈值时批准或否决"""
+        log.debug(f"--- 开始处理投票 for pending_id: {pending_id} ---")
+        with self._conn() as conn:
+            if not conn:
                 return
 
-            review_settings = self._get_review_settings(entry['entry_type'])
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM pending_entries WHERE id = ? AND status = 'pending'", (pending_id,))
+                entry = cursor.fetchone()
 
-            approvals = 0
-            rejections = 0
-            for reaction in message.reactions:
-                if str(reaction.emoji) == review_settings['vote_emoji']:
-                    approvals = reaction.count
-                elif str(reaction.emoji) == review_settings['reject_emoji']:
-                    rejections = reaction.count
-            
-            instant_approval_threshold = review_settings['instant_approval_threshold']
-            log.info(f"审核ID #{pending_id} (类型: {entry['entry_type']}): 当前票数 ✅{approvals}, ❌{rejections}。快速通过阈值: {instant_approval_threshold}")
-
-            if approvals >= instant_approval_threshold:
-                log.info(f"审核ID #{pending_id} 达到快速通过阈值。准备批准...")
-                await self.approve_entry(pending_id, entry, message, conn)
-            elif rejections >= review_settings['rejection_threshold']:
-                log.info(f"审核ID #{pending_id} 达到否决阈值。")
-                await self.reject_entry(pending_id, entry, message, conn, "社区投票否决")
-            else:
-                log.info(f"审核ID #{pending_id} 票数未达到任何阈值，等待更多投票或过期。")
+                if not entry:
+                    log.warning(f"在 process_vote 中找不到待审核的条目 #{pending_id} 或其状态不是 'pending'。")
+                    self.review_votes.pop(message.id, None)
+                    return
 
-        except Exception as e:
-            log.error(f"处理投票时发生错误 (ID: {pending_id}): {e}", exc_info=True)
-        finally:
-            conn.close()
+                review_settings = self._get_review_settings(entry['entry_type'])
+
+                reaction_counts = {str(reaction.emoji): reaction.count for reaction in message.reactions}
+                approvals = reaction_counts.get(review_settings['vote_emoji'], 0)
+                rejections = reaction_counts.get(review_settings['reject_emoji'], 0)
+            
+                instant_approval_threshold = review_settings['instant_approval_threshold']
+                log.info(f"审核ID #{pending_id} (类型: {entry['entry_type']}): 当前票数 ✅{approvals}, ❌{rejections}。快速通过阈值: {instant_approval_threshold}")
+
+                if approvals >= instant_approval_threshold:
+                    log.info(f"审核ID #{pending_id} 达到快速通过阈值。准备批准...")
+                    self.review_votes.pop(message.id, None)
+                    await self.approve_entry(pending_id, entry, message, conn)
+                elif rejections >= review_settings['rejection_threshold']:
+                    log.info(f"审核ID #{pending_id} 达到否决阈值。")
+                    self.review_votes.pop(message.id, None)
+                    await self.reject_entry(pending_id, entry, message, conn, "社区投票否决")
+                else:
+                    log.info(f"审核ID #{pending_id} 票数未达到任何阈值，等待更多投票或过期。")
+                    # 以消息上的真实票数校准本地计票，后续投票无需再拉取消息
+                    self.review_votes[message.id] = {
+                        'pending_id': pending_id,
+                        'vote_emoji': review_settings['vote_emoji'],
+                        'reject_emoji': review_settings['reject_emoji'],
+                        'approvals': approvals,
+                        'rejections': rejections,
+                        'approvers': set(),
+                        'rejecters': set(),
+                        'instant_approval_threshold': instant_approval_threshold,
+                        'rejection_threshold': review_settings['rejection_threshold'],
+                    }
+
+            except Exception as e:
+                log.error(f"处理投票时发生错误 (ID: {pending_id}): {e}", exc_info=True)
 
     async def approve_entry(self, pending_id: int, entry: sqlite3.Row, message: discord.Message, conn: sqlite3.Connection):
         """批准条目，将其写入主表并更新状态"""
@@ -176,8 +278,11 @@ class WorldBookCog(commands.Cog):
                 target_user_id = int(data['discord_id'])
                 profile_data = {k: data[k] for k in ['name', 'personality', 'background', 'preferences'] if k in data}
                 
-                await personal_memory_service.save_user_profile(target_user_id, profile_data)
-                await personal_memory_service.unlock_feature(target_user_id)
+                # 档案写入世界书数据库，解锁写入聊天数据库，两者互不依赖，可并发执行
+                await asyncio.gather(
+                    personal_memory_service.save_user_profile(target_user_id, profile_data),
+                    personal_memory_service.unlock_feature(target_user_id),
+                )
                 
                 new_entry_id = f"personal_profile_{target_user_id}" # 构造一个唯一的标识符
                 log.info(f"已将审核通过的个人档案 #{pending_id} 存入用户 {target_user_id} 的个人记忆中。")
@@ -206,6 +311,7 @@ class WorldBookCog(commands.Cog):
                     (entry_id, data['title'], data['name'], content_json, category_id, data.get('contributor_id'), 'approved')
                 )
                 new_entry_id = entry_id
+                world_book_db_manager.invalidate_cache()
                 log.info(f"已创建通用知识条目 {new_entry_id} (源自审核 #{pending_id})。")
                 embed_title = "✅ 世界之书知识已入库"
                 embed_description = f"感谢社区的审核！标题为 **{data['title']}** 的贡献已成功添加到世界之书中。"
@@ -213,6 +319,8 @@ class WorldBookCog(commands.Cog):
             if new_entry_id:
                 cursor.execute("UPDATE pending_entries SET status = 'approved' WHERE id = ?", (pending_id,))
                 conn.commit()
+                if entry_type == 'community_member':
+                    world_book_service.invalidate_profile_cache()
                 log.info(f"审核条目 #{pending_id} 状态已更新为 'approved'。")
 
                 if entry_type in ['general_knowledge', 'community_member']:
@@ -268,7 +376,8 @@ class WorldBookCog(commands.Cog):
 
                 # 尝试私信通知用户
                 try:
-                    user = await self.bot.fetch_user(user_id)
+                    # 优先使用缓存中的用户对象，缓存未命中时才请求 API
+                    user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
                     embed = discord.Embed(
                         title="【审核结果通知】",
                         description=f"抱歉，您提交的 **{data.get('name', '未知档案')}** 未能通过社区审核。",
@@ -327,61 +436,63 @@ class WorldBookCog(commands.Cog):
         await self.bot.wait_until_ready()
         log.debug("开始检查过期的审核条目...")
         
-        conn = self._get_db_connection()
-        if not conn:
-            return
-
-        try:
-            cursor = conn.cursor()
-            # 找出所有状态为 'pending' 且已过期的条目
-            now_iso = datetime.utcnow().isoformat()
-            cursor.execute("SELECT * FROM pending_entries WHERE status = 'pending' AND expires_at <= ?", (now_iso,))
-            expired_entries = cursor.fetchall()
-
-            if not expired_entries:
-                log.debug("没有找到过期的审核条目。")
+        with self._conn() as conn:
+            if not conn:
                 return
 
-            log.info(f"找到 {len(expired_entries)} 个过期的审核条目，正在处理...")
-
-            for entry in expired_entries:
-                try:
-                    channel = self.bot.get_channel(entry['channel_id'])
-                    if not channel:
-                        log.warning(f"找不到频道 {entry['channel_id']}，无法处理过期条目 #{entry['id']}")
-                        continue
+            try:
+                cursor = conn.cursor()
+                # 找出所有状态为 'pending' 且已过期的条目
+                now_iso = datetime.utcnow().isoformat()
+                cursor.execute("SELECT * FROM pending_entries WHERE status = 'pending' AND expires_at <= ?", (now_iso,))
+                expired_entries = cursor.fetchall()
+
+                if not expired_entries:
+                    log.debug("没有找到过期的审核条目。")
+                    return
+
+                log.info(f"找到 {len(expired_entries)} 个过期的审核条目，正在处理...")
+
+                for entry in expired_entries:
+                    self.review_votes.pop(entry['message_id'], None)
+                    self._vote_locks.pop(entry['message_id'], None)
+                    try:
+                        channel = self.bot.get_channel(entry['channel_id'])
+                        if not channel:
+                            log.warning(f"找不到频道 {entry['channel_id']}，无法处理过期条目 #{entry['id']}")
+                            continue
                     
-                    message = await channel.fetch_message(entry['message_id'])
+                        message = await channel.fetch_message(entry['message_id'])
                     
-                    approvals = 0
-                    for reaction in message.reactions:
-                        if str(reaction.emoji) == VOTE_EMOJI:
+                        review_settings = self._get_review_settings(entry['entry_type'])
+
+                        approvals = 0
+                        vote_reaction = discord.utils.find(
+                            lambda r: str(r.emoji) == review_settings['vote_emoji'], message.reactions
+                        )
+                        if vote_reaction:
                             # 在过期检查中，我们仍然需要排除机器人的初始反应
-                            async for user in reaction.users():
+                            async for user in vote_reaction.users():
                                 if not user.bot:
                                     approvals += 1
-                            break
                     
-                    review_settings = self._get_review_settings(entry['entry_type'])
-                    log.info(f"过期审核ID #{entry['id']} (类型: {entry['entry_type']}): 最终真实用户票数 ✅{approvals}。通过阈值: {review_settings['approval_threshold']}")
-
-                    if approvals >= review_settings['approval_threshold']:
-                        log.info(f"过期审核ID #{entry['id']} 满足通过条件。")
-                        await self.approve_entry(entry['id'], entry, message, conn)
-                    else:
-                        log.info(f"过期审核ID #{entry['id']} 未满足通过条件。")
-                        await self.reject_entry(entry['id'], entry, message, conn, "审核时间结束，票数不足")
-
-                except discord.NotFound:
-                    log.warning(f"找不到审核消息 {entry['message_id']}，将直接否决条目 #{entry['id']}")
-                    await self.reject_entry(entry['id'], entry, None, conn, "审核消息丢失")
-                except Exception as e:
-                    log.error(f"处理过期条目 #{entry['id']} 时发生错误: {e}", exc_info=True)
-
-        except Exception as e:
-            log.error(f"检查过期条目时发生数据库错误: {e}", exc_info=True)
-        finally:
-            conn.close()
+                        log.info(f"过期审核ID #{entry['id']} (类型: {entry['entry_type']}): 最终真实用户票数 ✅{approvals}。通过阈值: {review_settings['approval_threshold']}")
+
+                        if approvals >= review_settings['approval_threshold']:
+                            log.info(f"过期审核ID #{entry['id']} 满足通过条件。")
+                            await self.approve_entry(entry['id'], entry, message, conn)
+                        else:
+                            log.info(f"过期审核ID #{entry['id']} 未满足通过条件。")
+                            await self.reject_entry(entry['id'], entry, message, conn, "审核时间结束，票数不足")
+
+                    except discord.NotFound:
+                        log.warning(f"找不到审核消息 {entry['message_id']}，将直接否决条目 #{entry['id']}")
+                        await self.reject_entry(entry['id'], entry, None, conn, "审核消息丢失")
+                    except Exception as e:
+                        log.error(f"处理过期条目 #{entry['id']} 时发生错误: {e}", exc_info=True)
+
+            except Exception as e:
+                log.error(f"检查过期条目时发生数据库错误: {e}", exc_info=True)
 
 
 async def setup(bot: commands.Bot):
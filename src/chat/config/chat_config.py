@@ -148,6 +148,13 @@ CHANNEL_MEMORY_CONFIG = {
     "formatted_history_limit": 10,  # 格式化为AI模型可用的对话历史消息数量
 }
 
+# --- 暖贴功能 ---
+THREAD_COMMENTOR_CONFIG = {
+    "DELAY_SECONDS": (8, 22),  # (min, max) 秒，发帖后随机等待的时间
+    "MAX_CONCURRENT_PER_CHANNEL": 3,  # 同一论坛频道内同时生成评价的最大数量
+    "RAG_MIN_CONTENT_LENGTH": 80,  # 帖子内容短于此长度时跳过世界书 RAG 搜索
+}
+
 
 # --- Prompt 配置 ---
 PROMPT_CONFIG = {
@@ -11,6 +11,15 @@ from src import config
 from src.chat.features.world_book.services.incremental_rag_service import (
     incremental_rag_service,
 )
+from src.chat.features.world_book.database.world_book_db_manager import (
+    world_book_db_manager,
+)
+from src.chat.features.world_book.services.world_book_service import (
+    world_book_service,
+)
+
+# 写入后需要使用户档案缓存失效的表
+PROFILE_TABLES = ("community_members", "member_discord_nicknames")
 
 log = logging.getLogger(__name__)
 
@@ -123,6 +132,7 @@ class EditCommunityMemberModal(discord.ui.Modal):
 
             cursor.execute(sql, params)
             conn.commit()
+            world_book_service.invalidate_profile_cache()
             log.info(
                 f"管理员 {interaction.user.display_name} 成功更新了表 'community_members' 中 ID 为 {self.item_id} 的记录。"
             )
@@ -240,6 +250,10 @@ class EditModal(discord.ui.Modal):
             )
             cursor.execute(sql, tuple(update_values))
             conn.commit()
+            if self.table_name == "general_knowledge":
+                world_book_db_manager.invalidate_cache()
+            elif self.table_name in PROFILE_TABLES:
+                world_book_service.invalidate_profile_cache()
             log.info(
                 f"管理员 {interaction.user.display_name} 成功更新了表 '{self.table_name}' 中 ID 为 {self.item_id} 的记录。"
             )
@@ -571,6 +585,10 @@ class DBView(discord.ui.View):
                     f"DELETE FROM {self.current_table} WHERE id = ?", (item_id,)
                 )
                 conn.commit()
+                if self.current_table == "general_knowledge":
+                    world_book_db_manager.invalidate_cache()
+                elif self.current_table in PROFILE_TABLES:
+                    world_book_service.invalidate_profile_cache()
                 log.info(
                     f"管理员 {interaction.user.display_name} 删除了表 '{self.current_table}' 的记录 ID {item_id}。"
                 )
@@ -1,6 +1,9 @@
 import logging
-from src.chat.services.gemini_service import GeminiService
-from src.chat.features.affection.service.affection_service import AffectionService
+from src.chat.services.gemini_service import GeminiService, gemini_service
+from src.chat.features.affection.service.affection_service import (
+    AffectionService,
+    affection_service,
+)
 from src.chat.utils.prompt_utils import extract_persona_prompt
 from src.chat.config.prompts import SYSTEM_PROMPT
 from src.chat.config import chat_config as app_config # 导入 chat_config
@@ -48,3 +51,7 @@ class GiftService:
         log.info(f"为礼物 {item_name} 生成AI回应的返回结果: {response_text}")
         
         return response_text
+
+
+# 全局实例
+gift_service = GiftService(gemini_service, affection_service)
@@ -140,7 +140,7 @@ class CommunityMemberUploadModal(discord.ui.Modal, title="上传社区成员档
             try:
                 cursor = conn.cursor()
                 cursor.execute(
-                    "SELECT id FROM community_members WHERE discord_number_id = ? AND status = 'approved'",
+                    "SELECT id FROM community_members WHERE discord_number_id = ? AND status = 'approved' LIMIT 1",
                     (discord_id,)
                 )
                 row = cursor.fetchone()
@@ -1,6 +1,9 @@
 import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, Tuple
 
 from src.chat.utils.database import chat_db_manager
 from src.chat.config.chat_config import COIN_CONFIG
@@ -17,12 +20,30 @@ BLOCK_THREAD_REPLIES_EFFECT_ID = "block_thread_replies"
 ENABLE_THREAD_COMMENTOR_EFFECT_ID = "enable_thread_commentor"
 ENABLE_THREAD_REPLIES_EFFECT_ID = "enable_thread_replies"
 
+# 暖贴/帖子回复开关的进程内缓存有效期（秒）与最大缓存用户数
+REPLY_FLAGS_CACHE_TTL_SECONDS = 30
+REPLY_FLAGS_CACHE_MAXSIZE = 4096
+
+
+@dataclass(slots=True, frozen=True)
+class PurchaseOutcome:
+    """purchase_item 的返回结果"""
+
+    success: bool
+    message: str
+    new_balance: Optional[int]
+    show_modal: bool = False  # 购买后是否需要弹出模态框
+    generate_gift: bool = False  # 是否需要为礼物生成AI回应
+
 
 class CoinService:
     """处理与类脑币相关的所有业务逻辑"""
 
     def __init__(self):
-        pass
+        # user_id -> (过期时间, has_withered_sunflower, blocks_thread_replies)
+        self._reply_flags_cache: "OrderedDict[int, Tuple[float, bool, bool]]" = (
+            OrderedDict()
+        )
 
     async def get_balance(self, user_id: int) -> int:
         """获取用户的类脑币余额"""
@@ -269,25 +290,25 @@ class CoinService:
 
     async def purchase_item(
         self, user_id: int, guild_id: int, item_id: int, quantity: int = 1
-    ) -> tuple[bool, str, Optional[int], bool, bool]:
+    ) -> PurchaseOutcome:
         """
         处理用户购买商品的逻辑。
-        返回一个元组 (success: bool, message: str, new_balance: Optional[int], should_show_modal: bool, should_generate_gift_response: bool)。
+        返回一个 PurchaseOutcome，包含购买结果、提示消息、新余额以及后续需要执行的操作。
         """
         item = await self.get_item_by_id(item_id)
         if not item:
-            return False, "找不到该商品。", None, False, False
+            return PurchaseOutcome(
+                success=False, message="找不到该商品。", new_balance=None
+            )
 
         total_cost = item["price"] * quantity
         current_balance = await self.get_balance(user_id)
 
         if current_balance < total_cost:
-            return (
-                False,
-                f"你的余额不足！需要 {total_cost} 类脑币，但你只有 {current_balance}。",
-                None,
-                False,
-                False,
+            return PurchaseOutcome(
+                success=False,
+                message=f"你的余额不足！需要 {total_cost} 类脑币，但你只有 {current_balance}。",
+                new_balance=None,
             )
 
         # 扣款并记录（仅当费用大于0时）
@@ -296,7 +317,11 @@ class CoinService:
             reason = f"购买 {quantity}x {item['name']}"
             new_balance = await self.remove_coins(user_id, total_cost, reason)
             if new_balance is None:
-                return False, "购买失败，无法扣除类脑币。", None, False, False
+                return PurchaseOutcome(
+                    success=False,
+                    message="购买失败，无法扣除类脑币。",
+                    new_balance=None,
+                )
 
         # 根据物品目标执行不同操作
         item_target = item["target"]
@@ -314,7 +339,12 @@ class CoinService:
 
             if gift_success:
                 # 购买成功，返回空消息，并标记需要生成AI回应
-                return True, "", new_balance, False, True
+                return PurchaseOutcome(
+                    success=True,
+                    message="",
+                    new_balance=new_balance,
+                    generate_gift=True,
+                )
             else:
                 # 送礼失败，回滚交易
                 await self.add_coins(
@@ -323,7 +353,9 @@ class CoinService:
                 log.warning(
                     f"用户 {user_id} 送礼失败，已返还 {total_cost} 类脑币。原因: {gift_message}"
                 )
-                return False, gift_message, current_balance, False, False
+                return PurchaseOutcome(
+                    success=False, message=gift_message, new_balance=current_balance
+                )
 
         elif item_target == "self" and item_effect:
             # --- 给自己用且有立即效果的物品 ---
@@ -375,12 +407,10 @@ class CoinService:
 
                 await chat_db_manager._execute(_transaction)
 
-                return (
-                    True,
-                    f"你使用了 **{item['name']}**，花费了 {total_cost} 类脑币。在接下来的24小时内，你与类脑娘的对话冷却时间将大幅缩短！",
-                    new_balance,
-                    False,
-                    False,
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你使用了 **{item['name']}**，花费了 {total_cost} 类脑币。在接下来的24小时内，你与类脑娘的对话冷却时间将大幅缩短！",
+                    new_balance=new_balance,
                 )
             elif item_effect == PERSONAL_MEMORY_ITEM_EFFECT_ID:
                 # 检查用户是否已经拥有个人记忆功能
@@ -392,12 +422,11 @@ class CoinService:
                 if has_personal_memory:
                     # 用户已经拥有该功能，扣除10个类脑币作为更新费用
                     # 用户已经拥有该功能，同样需要弹出模态框让他们编辑
-                    return (
-                        True,
-                        f"你花费了 {total_cost} 类脑币来更新你的个人档案。",
-                        new_balance,
-                        True,
-                        False,
+                    return PurchaseOutcome(
+                        success=True,
+                        message=f"你花费了 {total_cost} 类脑币来更新你的个人档案。",
+                        new_balance=new_balance,
+                        show_modal=True,
                     )
                 else:
                     # 用户尚未拥有该功能，扣除500个类脑币并解锁功能
@@ -406,30 +435,27 @@ class CoinService:
                     )
 
                     await personal_memory_service.unlock_feature(user_id)
-                    return (
-                        True,
-                        f"你已成功解锁 **{item['name']}**！现在类脑娘将开始为你记录个人记忆。",
-                        new_balance,
-                        True,
-                        False,
+                    return PurchaseOutcome(
+                        success=True,
+                        message=f"你已成功解锁 **{item['name']}**！现在类脑娘将开始为你记录个人记忆。",
+                        new_balance=new_balance,
+                        show_modal=True,
                     )
             elif item_effect == WORLD_BOOK_CONTRIBUTION_ITEM_EFFECT_ID:
                 # 购买"知识纸条"商品，需要弹出模态窗口
-                return (
-                    True,
-                    f"你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**。",
-                    new_balance,
-                    True,
-                    False,
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**。",
+                    new_balance=new_balance,
+                    show_modal=True,
                 )
             elif item_effect == COMMUNITY_MEMBER_UPLOAD_EFFECT_ID:
                 # 购买"社区成员档案上传"商品，需要弹出模态窗口
-                return (
-                    True,
-                    f"你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**。",
-                    new_balance,
-                    True,
-                    False,
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**。",
+                    new_balance=new_balance,
+                    show_modal=True,
                 )
             elif item_effect == DISABLE_THREAD_COMMENTOR_EFFECT_ID:
                 # 购买“枯萎向日葵”，禁用暖贴功能
@@ -470,12 +496,11 @@ class CoinService:
                             conn.close()
 
                 await chat_db_manager._execute(_transaction)
-                return (
-                    True,
-                    f"你“购买”了 **{item['name']}**。从此，类脑娘将不再暖你的贴。",
-                    new_balance,
-                    False,
-                    False,
+                self._reply_flags_cache.pop(user_id, None)
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你“购买”了 **{item['name']}**。从此，类脑娘将不再暖你的贴。",
+                    new_balance=new_balance,
                 )
             elif item_effect == BLOCK_THREAD_REPLIES_EFFECT_ID:
 
@@ -516,12 +541,11 @@ class CoinService:
                             conn.close()
 
                 await chat_db_manager._execute(_transaction)
-                return (
-                    True,
-                    f"你举起了 **{item['name']}**，上面写着“禁止通行”。从此，类脑娘将不再进入你的帖子。",
-                    new_balance,
-                    False,
-                    False,
+                self._reply_flags_cache.pop(user_id, None)
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你举起了 **{item['name']}**，上面写着“禁止通行”。从此，类脑娘将不再进入你的帖子。",
+                    new_balance=new_balance,
                 )
             elif item_effect == ENABLE_THREAD_COMMENTOR_EFFECT_ID:
                 # 购买“魔法向日葵”，重新启用暖贴功能
@@ -543,12 +567,11 @@ class CoinService:
                         conn.close()
 
                 await chat_db_manager._execute(_transaction)
-                return (
-                    True,
-                    f"你使用了 **{item['name']}**，枯萎的向日葵恢复了生机。类脑娘现在会重新暖你的贴了。",
-                    new_balance,
-                    False,
-                    False,
+                self._reply_flags_cache.pop(user_id, None)
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你使用了 **{item['name']}**，枯萎的向日葵恢复了生机。类脑娘现在会重新暖你的贴了。",
+                    new_balance=new_balance,
                 )
             elif item_effect == ENABLE_THREAD_REPLIES_EFFECT_ID:
                 # 购买“通行许可”，重新启用帖子回复并设置默认CD
@@ -583,33 +606,29 @@ class CoinService:
                         conn.close()
 
                 await chat_db_manager._execute(_transaction)
+                self._reply_flags_cache.pop(user_id, None)
 
-                return (
-                    True,
-                    f"你使用了 **{item['name']}**，花费了 {total_cost} 类脑币。现在你创建的所有帖子将默认拥有 **60秒2次** 的发言许可，你也可以随时通过弹出的窗口自定义规则。",
-                    new_balance,
-                    True,
-                    False,
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"你使用了 **{item['name']}**，花费了 {total_cost} 类脑币。现在你创建的所有帖子将默认拥有 **60秒2次** 的发言许可，你也可以随时通过弹出的窗口自定义规则。",
+                    new_balance=new_balance,
+                    show_modal=True,
                 )
             else:
                 # 其他未知效果，暂时先放入背包
                 await self._add_item_to_inventory(user_id, item_id, quantity)
-                return (
-                    True,
-                    f"购买成功！你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**，已放入你的背包。",
-                    new_balance,
-                    False,
-                    False,
+                return PurchaseOutcome(
+                    success=True,
+                    message=f"购买成功！你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**，已放入你的背包。",
+                    new_balance=new_balance,
                 )
         else:
             # --- 普通物品，放入背包 ---
             await self._add_item_to_inventory(user_id, item_id, quantity)
-            return (
-                True,
-                f"购买成功！你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**，已放入你的背包。",
-                new_balance,
-                False,
-                False,
+            return PurchaseOutcome(
+                success=True,
+                message=f"购买成功！你花费了 {total_cost} 类脑币购买了 {quantity}x **{item['name']}**，已放入你的背包。",
+                new_balance=new_balance,
             )
 
     async def purchase_event_item(
@@ -697,29 +716,42 @@ class CoinService:
 
         return "default"
 
-    async def has_withered_sunflower(self, user_id: int) -> bool:
-        """检查用户是否拥有枯萎向日葵（即是否禁用了暖贴功能）"""
-        query = "SELECT has_withered_sunflower FROM user_coins WHERE user_id = ?"
+    async def get_reply_flags(self, user_id: int) -> Tuple[bool, bool]:
+        """
+        一次查询同时获取用户的两个开关：(是否禁用暖贴, 是否禁用帖子回复)。
+        结果会在进程内缓存一小段时间，本服务修改开关时会使缓存失效。
+        """
+        cached = self._reply_flags_cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._reply_flags_cache.move_to_end(user_id)
+            return cached[1], cached[2]
+
+        query = "SELECT has_withered_sunflower, blocks_thread_replies FROM user_coins WHERE user_id = ?"
         result = await chat_db_manager._execute(
             chat_db_manager._db_transaction, query, (user_id,), fetch="one"
         )
-        return (
-            result["has_withered_sunflower"]
-            if result and result["has_withered_sunflower"]
-            else False
+        withered = bool(result and result["has_withered_sunflower"])
+        blocked = bool(result and result["blocks_thread_replies"])
+
+        self._reply_flags_cache[user_id] = (
+            time.monotonic() + REPLY_FLAGS_CACHE_TTL_SECONDS,
+            withered,
+            blocked,
         )
+        self._reply_flags_cache.move_to_end(user_id)
+        while len(self._reply_flags_cache) > REPLY_FLAGS_CACHE_MAXSIZE:
+            self._reply_flags_cache.popitem(last=False)
+        return withered, blocked
+
+    async def has_withered_sunflower(self, user_id: int) -> bool:
+        """检查用户是否拥有枯萎向日葵（即是否禁用了暖贴功能）"""
+        withered, _ = await self.get_reply_flags(user_id)
+        return withered
 
     async def blocks_thread_replies(self, user_id: int) -> bool:
         """检查用户是否拥有告示牌（即是否禁用了帖子回复功能）"""
-        query = "SELECT blocks_thread_replies FROM user_coins WHERE user_id = ?"
-        result = await chat_db_manager._execute(
-            chat_db_manager._db_transaction, query, (user_id,), fetch="one"
-        )
-        return (
-            result["blocks_thread_replies"]
-            if result and result["blocks_thread_replies"]
-            else False
-        )
+        _, blocked = await self.get_reply_flags(user_id)
+        return blocked
 
     async def transfer_coins(
         self, sender_id: int, receiver_id: int, amount: int
@@ -803,6 +835,71 @@ class CoinService:
         except Exception as e:
             return False, f"❌ 转账时发生未知错误: {e}", None
 
+    async def _atomic_balance_and_loan(
+        self,
+        user_id: int,
+        delta: int,
+        reason: str,
+        loan_sql: str,
+        loan_params: tuple,
+    ) -> Optional[int]:
+        """
+        在同一个事务中调整用户余额、记录交易并更新借贷表，避免余额已变动而借贷记录写入失败。
+        扣款时如果余额不足，则返回 None，否则返回新的余额。
+        """
+
+        def _transaction():
+            import sqlite3
+
+            conn = None
+            try:
+                conn = sqlite3.connect(chat_db_manager.db_path)
+                cursor = conn.cursor()
+                if delta < 0:
+                    # 扣款时在同一条语句中校验余额，防止并发导致余额为负
+                    cursor.execute(
+                        "UPDATE user_coins SET balance = balance + ? WHERE user_id = ? AND balance >= ?",
+                        (delta, user_id, -delta),
+                    )
+                    if cursor.rowcount == 0:
+                        conn.rollback()
+                        return None
+                else:
+                    cursor.execute(
+                        """
+                        INSERT INTO user_coins (user_id, balance) VALUES (?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance;
+                    """,
+                        (user_id, delta),
+                    )
+
+                cursor.execute(
+                    "INSERT INTO coin_transactions (user_id, amount, reason) VALUES (?, ?, ?)",
+                    (user_id, delta, reason),
+                )
+                cursor.execute(loan_sql, loan_params)
+
+                cursor.execute(
+                    "SELECT balance FROM user_coins WHERE user_id = ?", (user_id,)
+                )
+                new_balance = cursor.fetchone()[0]
+
+                conn.commit()
+                log.info(
+                    f"用户 {user_id} 余额变动 {delta} 类脑币，原因: {reason}。新余额: {new_balance}"
+                )
+                return new_balance
+            except Exception as e:
+                if conn:
+                    conn.rollback()
+                log.error(f"为用户 {user_id} 处理借贷事务失败: {e}")
+                raise
+            finally:
+                if conn:
+                    conn.close()
+
+        return await chat_db_manager._execute(_transaction)
+
     async def get_active_loan(self, user_id: int) -> Optional[dict]:
         """获取用户当前未还清的贷款"""
         query = "SELECT * FROM coin_loans WHERE user_id = ? AND status = 'active'"
@@ -828,11 +925,12 @@ class CoinService:
             )
 
         try:
-            await self.add_coins(user_id, amount, "从系统借款")
-
-            query = "INSERT INTO coin_loans (user_id, amount) VALUES (?, ?)"
-            await chat_db_manager._execute(
-                chat_db_manager._db_transaction, query, (user_id, amount), commit=True
+            await self._atomic_balance_and_loan(
+                user_id,
+                amount,
+                "从系统借款",
+                "INSERT INTO coin_loans (user_id, amount) VALUES (?, ?)",
+                (user_id, amount),
             )
 
             log.info(f"用户 {user_id} 成功借款 {amount} 类脑币。")
@@ -857,17 +955,15 @@ class CoinService:
             )
 
         try:
-            new_balance = await self.remove_coins(user_id, loan_amount, "偿还系统贷款")
-            if new_balance is None:
-                return False, "❌ 还款失败，无法扣除类脑币。"
-
-            query = "UPDATE coin_loans SET status = 'paid', paid_at = CURRENT_TIMESTAMP WHERE loan_id = ?"
-            await chat_db_manager._execute(
-                chat_db_manager._db_transaction,
-                query,
+            new_balance = await self._atomic_balance_and_loan(
+                user_id,
+                -loan_amount,
+                "偿还系统贷款",
+                "UPDATE coin_loans SET status = 'paid', paid_at = CURRENT_TIMESTAMP WHERE loan_id = ?",
                 (active_loan["loan_id"],),
-                commit=True,
             )
+            if new_balance is None:
+                return False, "❌ 还款失败，无法扣除类脑币。"
 
             log.info(f"用户 {user_id} 成功偿还 {loan_amount} 类脑币的贷款。")
             return True, f"✅ 成功偿还 **{loan_amount}** 类脑币的贷款！"
@@ -2,7 +2,8 @@ import discord
 import logging
 import asyncio
 import uuid
-from typing import List, Dict, Any
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
 
 from discord.ext import commands
 
@@ -20,14 +21,32 @@ from src.chat.features.personal_memory.services.personal_memory_service import (
 )
 from src.chat.features.world_book.services.world_book_service import world_book_service
 from src.chat.config import chat_config
-from src.chat.features.affection.service.gift_service import GiftService
-from src.chat.features.affection.service.affection_service import affection_service
-from src.chat.services.gemini_service import gemini_service
+from src.chat.features.affection.service.gift_service import gift_service
 from src.chat.services.event_service import event_service
 from src.chat.features.events.ui.event_panel_view import EventPanelView
+from src.chat.features.world_book.ui.contribution_modal import (
+    WorldBookContributionModal,
+)
+from src.chat.features.community_member.ui.community_member_modal import (
+    CommunityMemberUploadModal,
+)
+from src.chat.features.personal_memory.ui.profile_modal import (
+    ProfileEditModal,
+    build_profile_embed_fields,
+    parse_profile_modal,
+)
 
 log = logging.getLogger(__name__)
 
+# 购买后需要先弹出模态框的商品效果ID -> 对应的模态框类
+MODAL_CLASSES: Dict[str, type] = {
+    WORLD_BOOK_CONTRIBUTION_ITEM_EFFECT_ID: WorldBookContributionModal,
+    COMMUNITY_MEMBER_UPLOAD_EFFECT_ID: CommunityMemberUploadModal,
+}
+
+# Discord Embed 单个字段值的最大长度
+EMBED_FIELD_VALUE_LIMIT = 1024
+
 
 def create_event_promo_embed(event_data: Dict[str, Any]) -> discord.Embed:
     """创建一个吸引人的活动推广Embed"""
@@ -274,25 +293,63 @@ class SimpleShopView(discord.ui.View):
         self.items = items
         self.selected_item_id = None
 
-        # 按类别分组商品
-        self.grouped_items = {}
+        # 按类别分组商品，同时建立 item_id 索引
+        grouped_items = defaultdict(list)
+        self._items_by_id: Dict[int, Dict[str, Any]] = {}
         for item in items:
-            category = item["category"]
-            if category not in self.grouped_items:
-                self.grouped_items[category] = []
-            self.grouped_items[category].append(item)
+            grouped_items[item["category"]].append(item)
+            self._items_by_id[int(item["item_id"])] = item
+        self.grouped_items: Dict[str, List[Dict[str, Any]]] = dict(grouped_items)
+        # 类别列表在视图生命周期内不变，预先排好序并拼接好展示文本
+        self._sorted_categories = sorted(self.grouped_items.keys())
+        self._categories_str = "\n".join(
+            f"✨ **{cat}**" for cat in self._sorted_categories
+        )
+        # 按类别缓存不含购买提示和余额的基础 Embed（None 表示类别列表页）
+        self._embed_cache: Dict[Optional[str], discord.Embed] = {}
+
+        # 常驻组件只创建一次，在类别页和商品页之间切换时复用
+        self._category_select = CategorySelect(list(self.grouped_items.keys()))
+        self._back_button = BackToCategoriesButton()
+        self._purchase_button = PurchaseButton()
+        self._refresh_button = RefreshBalanceButton()
+        # 按类别缓存商品选择菜单，重复进入同一类别时复用
+        self._item_selects: Dict[str, ItemSelect] = {}
 
         # 添加类别选择下拉菜单
-        self.add_item(CategorySelect(list(self.grouped_items.keys())))
+        self.add_item(self._category_select)
         # 添加购买按钮和刷新余额按钮
-        self.add_item(PurchaseButton())
-        self.add_item(RefreshBalanceButton())
+        self.add_item(self._purchase_button)
+        self.add_item(self._refresh_button)
         self.add_item(TransferButton())
         self.add_item(LoanButton())
         # --- 动态添加入口 ---
         if event_service.get_active_event():
             self.add_item(EventButton())
 
+    def show_category_page(self):
+        """切换到类别列表页的组件布局"""
+        self.clear_items()
+        self.add_item(self._category_select)
+        self.add_item(self._purchase_button)
+        self.add_item(self._refresh_button)
+
+    def get_item_select(self, category: str) -> "ItemSelect":
+        """获取指定类别的商品选择菜单，首次访问时创建并缓存"""
+        item_select = self._item_selects.get(category)
+        if item_select is None:
+            item_select = ItemSelect(category, self.grouped_items[category])
+            self._item_selects[category] = item_select
+        return item_select
+
+    def show_item_page(self, item_select: "ItemSelect"):
+        """切换到商品列表页的组件布局，只替换中间的商品选择菜单"""
+        self.clear_items()
+        self.add_item(item_select)
+        self.add_item(self._back_button)
+        self.add_item(self._purchase_button)
+        self.add_item(self._refresh_button)
+
     async def on_timeout(self):
         for item in self.children:
             item.disabled = True
@@ -310,10 +367,13 @@ class SimpleShopView(discord.ui.View):
             return False
         return True
 
-    def create_shop_embed(
-        self, purchase_message: str = None, category: str = None
+    def _build_shop_embed(
+        self,
+        purchase_message: str = None,
+        category: str = None,
+        gift_response: str = None,
     ) -> discord.Embed:
-        """创建商店的 Embed 消息"""
+        """构建不含余额页脚的商店 Embed；礼物的 AI 回应以单独字段显示在末尾"""
         description_text = "欢迎来到类脑商店！请选择你想要购买的商品。"
         if purchase_message:
             description_text = f"**{purchase_message}**\n\n" + description_text
@@ -330,12 +390,36 @@ class SimpleShopView(discord.ui.View):
         else:
             # 显示类别列表
             if self.items:
-                categories = sorted(list(set(item["category"] for item in self.items)))
-                categories_str = "\n".join([f"✨ **{cat}**" for cat in categories])
-                embed.add_field(name="商品类别", value=categories_str, inline=False)
+                embed.add_field(
+                    name="商品类别", value=self._categories_str, inline=False
+                )
             else:
                 embed.add_field(name="", value="商店暂时没有商品哦。", inline=False)
 
+        if gift_response:
+            embed.add_field(
+                name="💝 礼物回应",
+                value=gift_response[:EMBED_FIELD_VALUE_LIMIT],
+                inline=False,
+            )
+        return embed
+
+    def create_shop_embed(
+        self,
+        purchase_message: str = None,
+        category: str = None,
+        gift_response: str = None,
+    ) -> discord.Embed:
+        """创建商店的 Embed 消息；购买结果只用于本次渲染，之后的重绘不会再显示"""
+        if purchase_message:
+            embed = self._build_shop_embed(purchase_message, category, gift_response)
+        else:
+            base_embed = self._embed_cache.get(category)
+            if base_embed is None:
+                base_embed = self._build_shop_embed(category=category)
+                self._embed_cache[category] = base_embed
+            embed = base_embed.copy()
+
         embed.set_footer(text=f"你的余额: {self.balance} 类脑币")
         return embed
 
@@ -363,17 +447,11 @@ class CategorySelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         selected_category = self.values[0]
-        # 创建商品选择下拉菜单
-        item_select = ItemSelect(
-            selected_category, self.view.grouped_items[selected_category]
-        )
+        # 获取（或首次创建）商品选择下拉菜单
+        item_select = self.view.get_item_select(selected_category)
 
         # 更新视图，移除类别选择，添加商品选择
-        self.view.clear_items()
-        self.view.add_item(item_select)
-        self.view.add_item(BackToCategoriesButton())
-        self.view.add_item(PurchaseButton())
-        self.view.add_item(RefreshBalanceButton())
+        self.view.show_item_page(item_select)
 
         # 更新嵌入消息，显示选中的类别
         new_embed = self.view.create_shop_embed(category=selected_category)
@@ -420,11 +498,8 @@ class BackToCategoriesButton(discord.ui.Button):
         )
 
     async def callback(self, interaction: discord.Interaction):
-        # 重新创建类别选择视图
-        self.view.clear_items()
-        self.view.add_item(CategorySelect(list(self.view.grouped_items.keys())))
-        self.view.add_item(PurchaseButton())
-        self.view.add_item(RefreshBalanceButton())
+        # 切回类别选择视图，复用已有组件
+        self.view.show_category_page()
 
         # 更新嵌入消息，回到类别列表
         new_embed = self.view.create_shop_embed()
@@ -468,14 +543,7 @@ class PurchaseButton(discord.ui.Button):
             )
             return
 
-        selected_item = next(
-            (
-                item
-                for item in self.view.items
-                if item["item_id"] == self.view.selected_item_id
-            ),
-            None,
-        )
+        selected_item = self.view._items_by_id.get(self.view.selected_item_id)
         if not selected_item:
             await interaction.response.send_message("选择的商品无效。", ephemeral=True)
             return
@@ -488,80 +556,90 @@ class PurchaseButton(discord.ui.Button):
             return
 
         # --- 其他模态框购买流程 (保持原样) ---
-        modal_effects = [
-            WORLD_BOOK_CONTRIBUTION_ITEM_EFFECT_ID,
-            COMMUNITY_MEMBER_UPLOAD_EFFECT_ID,
-        ]
-        if item_effect in modal_effects:
+        if item_effect in MODAL_CLASSES:
             await self.handle_standard_modal_purchase(interaction, selected_item)
             return
 
         # --- 普通商品购买流程 ---
         await self.handle_standard_purchase(interaction, selected_item)
 
-    async def handle_personal_memory_purchase(
+    async def _precheck_balance(
         self, interaction: discord.Interaction, item: Dict[str, Any]
-    ):
-        """处理个人记忆商品的购买，采用先开模态框后扣款的逻辑"""
-        # 1. 检查余额
+    ) -> bool:
+        """
+        弹出模态框前的余额预检查。
+        视图中的余额足够时直接放行，不访问数据库，以便尽快响应交互（Discord 要求 3 秒内响应）；
+        只有看起来不足时才查询最新余额。真正的扣款校验在模态框提交后进行。
+        """
+        if self.view.balance >= item["price"]:
+            return True
+
         current_balance = await coin_service.get_balance(interaction.user.id)
+        self.view.balance = current_balance
         if current_balance < item["price"]:
             await interaction.response.send_message(
                 f"你的余额不足！需要 {item['price']} 类脑币，但你只有 {current_balance}。",
                 ephemeral=True,
             )
+            return False
+        return True
+
+    async def handle_personal_memory_purchase(
+        self, interaction: discord.Interaction, item: Dict[str, Any]
+    ):
+        """处理个人记忆商品的购买，采用先开模态框后扣款的逻辑"""
+        # 1. 检查余额
+        if not await self._precheck_balance(interaction, item):
+            return
+
+        # 模态框的提交由 PersonalMemoryCog 按 custom_id 转交过来
+        personal_memory_cog = self.view.bot.get_cog("PersonalMemoryCog")
+        if personal_memory_cog is None:
+            await interaction.response.send_message(
+                "个人档案功能暂时不可用，请联系管理员。", ephemeral=True
+            )
             return
 
         # 2. 创建一个带唯一ID的模态框
-        from src.chat.features.personal_memory.ui.profile_modal import ProfileEditModal
-
         unique_id = f"personal_profile_edit_modal_{uuid.uuid4()}"
         modal = ProfileEditModal(custom_id=unique_id)
         await interaction.response.send_modal(modal)
 
         try:
             # 3. 等待模态框提交
-            modal_interaction: discord.Interaction = await self.view.bot.wait_for(
-                "interaction",
-                check=lambda i: i.type == discord.InteractionType.modal_submit
-                and i.data.get("custom_id") == unique_id,
-                timeout=300.0,  # 5分钟超时
+            modal_interaction: discord.Interaction = (
+                await personal_memory_cog.wait_for_profile_modal(
+                    unique_id, timeout=300.0  # 5分钟超时
+                )
             )
 
             # 4. 用户提交后，先扣款
             await modal_interaction.response.defer(ephemeral=True)
 
-            success, message, new_balance, _, _ = await coin_service.purchase_item(
+            outcome = await coin_service.purchase_item(
                 interaction.user.id,
                 interaction.guild.id if interaction.guild else 0,
                 item["item_id"],
             )
 
-            if not success:
+            if not outcome.success:
                 await modal_interaction.followup.send(
-                    f"购买失败：{message}", ephemeral=True
+                    f"购买失败：{outcome.message}", ephemeral=True
                 )
                 return
 
             # 5. 扣款成功后，保存个人档案
-            components = modal_interaction.data.get("components", [])
-            values_by_id = {
-                comp["components"][0]["custom_id"]: comp["components"][0]["value"]
-                for comp in components
-                if comp.get("components") and comp["components"]
-            }
-            profile_data = {
-                "name": values_by_id.get("name", "").strip(),
-                "personality": values_by_id.get("personality", "").strip(),
-                "background": values_by_id.get("background", "").strip(),
-                "preferences": values_by_id.get("preferences", "").strip(),
-                "discord_id": str(interaction.user.id),
-                "uploaded_by": interaction.user.id,
-                "uploaded_by_name": interaction.user.display_name,
-                "update_target_id": str(
-                    interaction.user.id
-                ),  # 商店购买总是首次创建或覆盖
-            }
+            profile_data = parse_profile_modal(modal_interaction.data)
+            profile_data.update(
+                {
+                    "discord_id": str(interaction.user.id),
+                    "uploaded_by": interaction.user.id,
+                    "uploaded_by_name": interaction.user.display_name,
+                    "update_target_id": str(
+                        interaction.user.id
+                    ),  # 商店购买总是首次创建或覆盖
+                }
+            )
 
             if not profile_data["name"] or not profile_data["personality"]:
                 await modal_interaction.followup.send(
@@ -589,36 +667,14 @@ class PurchaseButton(discord.ui.Button):
             embed_title = "哇!我收到了一张新名片！"
             embed_description = f"**{interaction.user.display_name}** 递给了我一张TA的名片，大伙怎么看？"
 
-            embed_fields = [
-                {"name": "名称", "value": profile_data["name"], "inline": True},
-                {
-                    "name": "性格特点",
-                    "value": profile_data["personality"][:300]
-                    + ("..." if len(profile_data["personality"]) > 300 else ""),
-                    "inline": False,
-                },
-            ]
-            if profile_data["background"]:
-                embed_fields.append(
-                    {
-                        "name": "背景信息",
-                        "value": profile_data["background"][:200]
-                        + ("..." if len(profile_data["background"]) > 200 else ""),
-                        "inline": False,
-                    }
-                )
-            if profile_data["preferences"]:
-                embed_fields.append(
-                    {
-                        "name": "喜好偏好",
-                        "value": profile_data["preferences"][:200]
-                        + ("..." if len(profile_data["preferences"]) > 200 else ""),
-                        "inline": False,
-                    }
-                )
+            embed_fields = build_profile_embed_fields(profile_data)
+
+            # 6. 发起审核的同时更新商店界面，两者是互不依赖的 Discord 请求
+            self.view.balance = outcome.new_balance
+            new_embed = self.view.create_shop_embed()
 
             # 注意：这里我们使用 modal_interaction 来发送后续消息，但审核流程需要原始的 interaction 来定位频道
-            await world_book_service.initiate_review_process(
+            review_task = world_book_service.initiate_review_process(
                 interaction=interaction,  # 使用原始的 interaction
                 entry_type="personal_profile",
                 entry_data=profile_data,
@@ -630,11 +686,10 @@ class PurchaseButton(discord.ui.Button):
                 purchase_info=purchase_info,  # --- 传递支付信息 ---
                 followup_interaction=modal_interaction,  # 传递 modal_interaction 用于发送反馈
             )
-
-            # 6. 更新商店界面
-            self.view.balance = new_balance
-            new_embed = self.view.create_shop_embed()
-            await interaction.edit_original_response(embed=new_embed, view=self.view)
+            await asyncio.gather(
+                review_task,
+                interaction.edit_original_response(embed=new_embed, view=self.view),
+            )
 
         except asyncio.TimeoutError:
             # 7. 用户未提交，超时处理
@@ -653,42 +708,23 @@ class PurchaseButton(discord.ui.Button):
     ):
         """处理需要弹出模态框的商品的购买，采用先开模态框后扣款的逻辑"""
         # 1. 快速检查余额
-        current_balance = await coin_service.get_balance(interaction.user.id)
-        if current_balance < item["price"]:
-            await interaction.response.send_message(
-                f"你的余额不足！需要 {item['price']} 类脑币，但你只有 {current_balance}。",
-                ephemeral=True,
-            )
+        if not await self._precheck_balance(interaction, item):
             return
 
         # 2. 立即弹出模态框，并将购买信息传递过去
-        modal_map = {
-            WORLD_BOOK_CONTRIBUTION_ITEM_EFFECT_ID: "src.chat.features.world_book.ui.contribution_modal.WorldBookContributionModal",
-            COMMUNITY_MEMBER_UPLOAD_EFFECT_ID: "src.chat.features.community_member.ui.community_member_modal.CommunityMemberUploadModal",
-        }
-        modal_path = modal_map.get(item["effect_id"])
-        if not modal_path:
+        ModalClass = MODAL_CLASSES.get(item["effect_id"])
+        if not ModalClass:
             await interaction.response.send_message(
                 "无法找到此商品对应的功能。", ephemeral=True
             )
             return
 
         try:
-            parts = modal_path.split(".")
-            module_path, class_name = ".".join(parts[:-1]), parts[-1]
-            module = __import__(module_path, fromlist=[class_name])
-            ModalClass = getattr(module, class_name)
-
             purchase_info = {"item_id": item["item_id"], "price": item["price"]}
             modal = ModalClass(purchase_info=purchase_info)
 
             await interaction.response.send_modal(modal)
             # 交互已经响应，后续的扣款和消息更新将在模态框的 on_submit 中处理
-        except (ImportError, AttributeError) as e:
-            log.error(f"动态加载模态框失败: {e}", exc_info=True)
-            await interaction.response.send_message(
-                "打开功能界面时出错，请联系管理员。", ephemeral=True
-            )
         except Exception as e:
             log.error(f"处理标准模态框购买时发生未知错误: {e}", exc_info=True)
             if not interaction.response.is_done():
@@ -702,38 +738,44 @@ class PurchaseButton(discord.ui.Button):
         """处理普通商品的购买"""
         await interaction.response.defer(ephemeral=True)
         try:
-            (
-                success,
-                message,
-                new_balance,
-                should_show_modal,
-                should_generate_gift_response,
-            ) = await coin_service.purchase_item(
+            outcome = await coin_service.purchase_item(
                 interaction.user.id,
                 interaction.guild.id if interaction.guild else 0,
                 item["item_id"],
             )
 
-            final_message = message
-            if success and should_generate_gift_response:
-                gift_service = GiftService(gemini_service, affection_service)
+            if not outcome.success:
+                await interaction.followup.send(outcome.message, ephemeral=True)
+                return
+
+            gift_response = None
+            if outcome.generate_gift:
                 try:
-                    ai_response = await gift_service.generate_gift_response(
+                    gift_response = await gift_service.generate_gift_response(
                         interaction.user, item["name"]
                     )
-                    final_message += f"\n\n{ai_response}"
                 except Exception as e:
                     log.error(f"为礼物 {item['name']} 生成AI回应时出错: {e}")
-                    final_message += (
-                        "\n\n（AI 在想感谢语时遇到了点小麻烦，但你的心意已经收到了！）"
+                    gift_response = (
+                        "（AI 在想感谢语时遇到了点小麻烦，但你的心意已经收到了！）"
                     )
 
+            # 购买成功时把结果合并进商店 Embed，一次编辑即可完成反馈和余额更新
+            self.view.balance = outcome.new_balance
+            new_embed = self.view.create_shop_embed(
+                purchase_message=outcome.message.strip(), gift_response=gift_response
+            )
             try:
-                await interaction.followup.send(final_message, ephemeral=True)
+                await interaction.edit_original_response(
+                    embed=new_embed, view=self.view
+                )
             except discord.errors.NotFound:
                 log.warning(
-                    f"Followup failed for user {interaction.user.id}, sending DM as fallback."
+                    f"Editing shop message failed for user {interaction.user.id}, sending DM as fallback."
                 )
+                final_message = outcome.message
+                if gift_response:
+                    final_message += f"\n\n{gift_response}"
                 try:
                     await interaction.user.send(f"你的购买已完成！\n\n{final_message}")
                 except discord.errors.Forbidden:
@@ -741,18 +783,11 @@ class PurchaseButton(discord.ui.Button):
                         f"Failed to send DM to user {interaction.user.id} as a fallback."
                     )
 
-            if success:
-                self.view.balance = new_balance
-                new_embed = self.view.create_shop_embed()
-                await interaction.edit_original_response(
-                    embed=new_embed, view=self.view
-                )
-
-                if (
-                    should_show_modal
-                    and item.get("effect_id") == ENABLE_THREAD_REPLIES_EFFECT_ID
-                ):
-                    await self.handle_thread_settings_modal(interaction)
+            if (
+                outcome.show_modal
+                and item.get("effect_id") == ENABLE_THREAD_REPLIES_EFFECT_ID
+            ):
+                await self.handle_thread_settings_modal(interaction)
 
         except Exception as e:
             log.error(f"处理购买商品 {item['item_id']} 时出错: {e}", exc_info=True)
@@ -850,16 +885,15 @@ class RefreshBalanceButton(discord.ui.Button):
         )
 
     async def callback(self, interaction: discord.Interaction):
+        # 先确认交互，避免数据库查询占用 3 秒的确认期限
         await interaction.response.defer()
-        # 重新获取用户余额
-        new_balance = await coin_service.get_balance(interaction.user.id)
-        self.view.balance = new_balance
-
-        # 创建一个新的 embed 来更新余额显示
-        # 注意：我们不会改变视图（view），只更新嵌入消息（embed）
-        # 我们需要确定当前所在的 embed 是哪个
-        current_embed = interaction.message.embeds[0]
+        # 刷新按钮总是重新获取用户余额，余额可能已在其他地方发生变化
+        self.view.balance = await coin_service.get_balance(interaction.user.id)
+
+        # 只有余额页脚发生变化：复制当前消息的 embed 并替换页脚，无需重建整个 embed
+        # 注意：我们不会改变视图（view），组件保持不变
+        current_embed = interaction.message.embeds[0].copy()
         current_embed.set_footer(text=f"你的余额: {self.view.balance} 类脑币")
 
         # 编辑原始消息，只更新 embed
-        await interaction.edit_original_response(embed=current_embed, view=self.view)
+        await interaction.edit_original_response(embed=current_embed)
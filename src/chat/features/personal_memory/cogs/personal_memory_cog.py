@@ -1,32 +1,65 @@
 import discord
 from discord.ext import commands
+import asyncio
 import logging
 import sqlite3
 import os
+from contextlib import contextmanager
 from typing import Dict
 
 from src import config
 from src.chat.config import chat_config
 from ..services.personal_memory_service import personal_memory_service
-from ..ui.profile_modal import PROFILE_MODAL_CUSTOM_ID
+from ..ui.profile_modal import PROFILE_MODAL_CUSTOM_ID, parse_profile_modal, build_profile_embed_fields
 from src.chat.features.world_book.services.world_book_service import world_book_service
+from src.chat.utils.sqlite_pool import get_pool
 
 log = logging.getLogger(__name__)
 
+# 查询用户已审核通过的档案，命中 idx_community_members_discord_status 覆盖索引
+APPROVED_PROFILE_QUERY = (
+    "SELECT id FROM community_members WHERE discord_number_id = ? AND status = 'approved' LIMIT 1"
+)
+
 class PersonalMemoryCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.service = personal_memory_service
         self.world_book_db_path = os.path.join(config.DATA_DIR, 'world_book.sqlite3')
+        # 商店购买流程中等待提交的个人档案模态框，按 custom_id 索引
+        self.pending_profile_modals: Dict[str, asyncio.Future] = {}
+
+    async def wait_for_profile_modal(self, custom_id: str, timeout: float) -> discord.Interaction:
+        """等待指定 custom_id 的模态框被提交，超时抛出 asyncio.TimeoutError。"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending_profile_modals[custom_id] = future
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self.pending_profile_modals.pop(custom_id, None)
 
-    def _get_world_book_connection(self):
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个世界书数据库连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(self.world_book_db_path)
         try:
-            conn = sqlite3.connect(self.world_book_db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            conn = pool.acquire()
         except sqlite3.Error as e:
             log.error(f"连接到世界书数据库失败: {e}", exc_info=True)
-            return None
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    def _has_approved_profile(self, user_id: int) -> bool:
+        """同步查询用户是否已有审核通过的社区成员档案（在线程中执行）"""
+        with self._conn() as conn:
+            if not conn:
+                return False
+            row = conn.execute(APPROVED_PROFILE_QUERY, (str(user_id),)).fetchone()
+            return row is not None
 
     @commands.Cog.listener('on_interaction')
     async def on_modal_submit(self, interaction: discord.Interaction):
@@ -34,27 +67,25 @@ class PersonalMemoryCog(commands.Cog):
             return
         
         custom_id = interaction.data.get("custom_id")
+        pending = self.pending_profile_modals.pop(custom_id, None)
+        if pending is not None:
+            # 由商店购买流程自行处理该模态框
+            if not pending.done():
+                pending.set_result(interaction)
+            return
+
         if custom_id != PROFILE_MODAL_CUSTOM_ID:
             return
 
         try:
             await interaction.response.defer(ephemeral=True)
 
-            components = interaction.data.get('components', [])
-            values_by_id = {
-                comp['components'][0]['custom_id']: comp['components'][0]['value']
-                for comp in components if comp.get('components')
-            }
-
-            profile_data = {
-                'name': values_by_id.get('name', '').strip(),
-                'personality': values_by_id.get('personality', '').strip(),
-                'background': values_by_id.get('background', '').strip(),
-                'preferences': values_by_id.get('preferences', '').strip(),
+            profile_data = parse_profile_modal(interaction.data)
+            profile_data.update({
                 'discord_id': str(interaction.user.id),
                 'uploaded_by': interaction.user.id,
                 'uploaded_by_name': interaction.user.display_name
-            }
+            })
 
             if not profile_data['name'] or not profile_data['personality']:
                 await interaction.followup.send("名称和性格特点不能为空。", ephemeral=True)
@@ -62,21 +93,13 @@ class PersonalMemoryCog(commands.Cog):
 
             # --- 新增：检查是创建还是更新 ---
             is_update = False
-            conn = self._get_world_book_connection()
-            if conn:
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "SELECT id FROM community_members WHERE discord_number_id = ? AND status = 'approved'",
-                        (str(interaction.user.id),)
-                    )
-                    if cursor.fetchone():
-                        is_update = True
-                        log.info(f"检测到用户 {interaction.user.id} 的个人档案更新请求。")
-                except sqlite3.Error as e:
-                    log.error(f"查询现有个人档案时出错: {e}", exc_info=True)
-                finally:
-                    conn.close()
+            try:
+                # 在线程中查询，避免阻塞事件循环
+                if await asyncio.to_thread(self._has_approved_profile, interaction.user.id):
+                    is_update = True
+                    log.info(f"检测到用户 {interaction.user.id} 的个人档案更新请求。")
+            except sqlite3.Error as e:
+                log.error(f"查询现有个人档案时出错: {e}", exc_info=True)
             
             profile_data['update_target_id'] = str(interaction.user.id)
 
@@ -88,14 +111,7 @@ class PersonalMemoryCog(commands.Cog):
             else:
                 embed_description = f"**{interaction.user.display_name}** 递给了我一张TA的名片，大伙怎么看?"
             
-            embed_fields = [
-                {"name": "名称", "value": profile_data['name'], "inline": True},
-                {"name": "性格特点", "value": profile_data['personality'][:300] + ('...' if len(profile_data['personality']) > 300 else ''), "inline": False}
-            ]
-            if profile_data['background']:
-                embed_fields.append({"name": "背景信息", "value": profile_data['background'][:200] + ('...' if len(profile_data['background']) > 200 else ''), "inline": False})
-            if profile_data['preferences']:
-                embed_fields.append({"name": "喜好偏好", "value": profile_data['preferences'][:200] + ('...' if len(profile_data['preferences']) > 200 else ''), "inline": False})
+            embed_fields = build_profile_embed_fields(profile_data)
 
             await world_book_service.initiate_review_process(
                 interaction=interaction,
@@ -1,38 +1,78 @@
 import discord
 import logging
-import json
+import asyncio
 import sqlite3
 import os
-from typing import Dict
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime, timezone
 
 from src.chat.utils.database import chat_db_manager
+from src.chat.utils import json_utils
+from src.chat.utils.sqlite_pool import get_pool
 from src.chat.config.chat_config import PERSONAL_MEMORY_CONFIG, PROMPT_CONFIG, SUMMARY_MODEL, GEMINI_SUMMARY_GEN_CONFIG
 from src.chat.features.personal_memory.ui.profile_modal import ProfileEditView
 from src.chat.services.gemini_service import gemini_service
 from src.chat.features.world_book.services.incremental_rag_service import incremental_rag_service
+from src.chat.features.world_book.services.world_book_service import world_book_service
 # 新增导入，用于获取频道历史
 from src.chat.services.context_service import context_service
 from src import config
 
 log = logging.getLogger(__name__)
 
+# 用户记忆文本缓存的有效期（秒）与最大缓存用户数
+MEMORY_CACHE_TTL_SECONDS = 300
+MEMORY_CACHE_MAXSIZE = 1024
+
 class PersonalMemoryService:
     def __init__(self):
         self.db_manager = chat_db_manager
         self.world_book_db_path = os.path.join(config.DATA_DIR, 'world_book.sqlite3')
         # 用于追踪需要监听反应的投票消息 ID 及其发起时间
         self.approval_message_ids: Dict[int, datetime] = {}
+        # 用户记忆文本的 LRU 缓存: {user_id: (过期时间, 记忆文本)}，档案或摘要更新时失效
+        self._memory_cache: "OrderedDict[int, Tuple[float, str]]" = OrderedDict()
+
+    def get_cached_memory(self, user_id: int) -> Optional[str]:
+        """读取缓存的用户记忆文本，未命中或已过期时返回 None。"""
+        cached = self._memory_cache.get(user_id)
+        if cached is None:
+            return None
+        expires_at, memory = cached
+        if expires_at <= time.monotonic():
+            del self._memory_cache[user_id]
+            return None
+        self._memory_cache.move_to_end(user_id)
+        return memory
 
-    def _get_world_book_connection(self):
-        """获取世界书数据库的连接"""
+    def cache_memory(self, user_id: int, memory: str):
+        """缓存用户记忆文本，超出容量时淘汰最久未使用的条目。"""
+        self._memory_cache[user_id] = (time.monotonic() + MEMORY_CACHE_TTL_SECONDS, memory)
+        self._memory_cache.move_to_end(user_id)
+        while len(self._memory_cache) > MEMORY_CACHE_MAXSIZE:
+            self._memory_cache.popitem(last=False)
+
+    def invalidate_memory_cache(self, user_id: int):
+        """用户档案或记忆摘要发生变化时，使其缓存的记忆文本失效。"""
+        self._memory_cache.pop(user_id, None)
+
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个世界书数据库连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(self.world_book_db_path)
         try:
-            conn = sqlite3.connect(self.world_book_db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            conn = pool.acquire()
         except sqlite3.Error as e:
             log.error(f"连接到世界书数据库失败: {e}", exc_info=True)
-            return None
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
 
     async def start_approval_process(self, channel: discord.TextChannel, user: discord.Member):
         """
@@ -105,50 +145,18 @@ class PersonalMemoryService:
             "preferences": profile_data.get('preferences', '未提供')
         }
         
-        content_json = json.dumps(member_data, ensure_ascii=False)
+        content_json = json_utils.dumps(member_data)
         
-        conn = self._get_world_book_connection()
-        if not conn:
-            log.error("无法连接到世界书数据库，无法保存用户档案")
-            return
+        title = f"用户档案 - {profile_data.get('name', '匿名')}"
+        # 数据库写入在线程中执行，不阻塞事件循环
+        rag_update_id, is_update = await asyncio.to_thread(
+            self._write_user_profile, user_id, title, content_json
+        )
 
-        rag_update_id = None
-        is_update = False
+        self.invalidate_memory_cache(user_id)
+        world_book_service.invalidate_profile_cache(str(user_id))
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id FROM community_members WHERE discord_number_id = ?",
-                (str(user_id),)
-            )
-            existing_member = cursor.fetchone()
-            
-            if existing_member:
-                is_update = True
-                rag_update_id = existing_member['id']
-                cursor.execute(
-                    "UPDATE community_members SET title = ?, content_json = ? WHERE discord_number_id = ?",
-                    (f"用户档案 - {profile_data.get('name', '匿名')}", content_json, str(user_id))
-                )
-                log.info(f"已更新用户 {user_id} 在世界书数据库中的社区成员档案。")
-            else:
-                is_update = False
-                rag_update_id = f"user_{user_id}"
-                cursor.execute(
-                    "INSERT INTO community_members (id, title, discord_number_id, content_json) VALUES (?, ?, ?, ?)",
-                    (rag_update_id, f"用户档案 - {profile_data.get('name', '匿名')}", str(user_id), content_json)
-                )
-                log.info(f"已为用户 {user_id} 在世界书数据库中创建社区成员档案。")
-            
-            conn.commit()
-        except sqlite3.Error as e:
-            log.error(f"保存用户档案到世界书数据库时出错: {e}", exc_info=True)
-            conn.rollback()
-            rag_update_id = None # 如果数据库操作失败，则不尝试RAG同步
-        finally:
-            conn.close()
-
-        # --- RAG 同步 (在数据库连接关闭后执行) ---
+        # --- RAG 同步 (在写事务提交后执行) ---
         if rag_update_id:
             try:
                 if is_update:
@@ -164,6 +172,38 @@ class PersonalMemoryService:
                 log.error(f"在保存用户档案后进行RAG同步时出错 (ID: {rag_update_id}): {e}", exc_info=True)
 
 
+    def _write_user_profile(self, user_id: int, title: str, content_json: str) -> Tuple[Optional[str], bool]:
+        """save_user_profile 的同步实现，返回 (需要同步到 RAG 的档案ID, 是否为更新)；写入失败时档案ID为 None。"""
+        with self._conn() as conn:
+            if not conn:
+                log.error("无法连接到世界书数据库，无法保存用户档案")
+                return None, False
+
+            try:
+                # 先直接尝试更新，并通过 RETURNING 拿到已有档案的ID，省去更新前的查询
+                updated_rows = conn.execute(
+                    "UPDATE community_members SET title = ?, content_json = ? WHERE discord_number_id = ? RETURNING id",
+                    (title, content_json, str(user_id))
+                ).fetchall()
+
+                if updated_rows:
+                    rag_update_id, is_update = updated_rows[0]['id'], True
+                    log.info(f"已更新用户 {user_id} 在世界书数据库中的社区成员档案。")
+                else:
+                    rag_update_id, is_update = f"user_{user_id}", False
+                    conn.execute(
+                        "INSERT INTO community_members (id, title, discord_number_id, content_json) VALUES (?, ?, ?, ?)",
+                        (rag_update_id, title, str(user_id), content_json)
+                    )
+                    log.info(f"已为用户 {user_id} 在世界书数据库中创建社区成员档案。")
+
+                conn.commit()
+                return rag_update_id, is_update
+            except sqlite3.Error as e:
+                log.error(f"保存用户档案到世界书数据库时出错: {e}", exc_info=True)
+                conn.rollback()
+                return None, False # 如果数据库操作失败，则不尝试RAG同步
+
     async def increment_and_check_message_count(self, user_id: int, guild_id: int) -> int:
         """
         增加用户的个人消息计数，并返回新的计数值。
@@ -183,48 +223,58 @@ class PersonalMemoryService:
     async def summarize_and_save_memory(self, user_id: int, guild_id: int):
         """获取用户的对话历史（根据 guild_id 区分私聊和频道），生成摘要，并保存到数据库。"""
         log.info(f"用户 {user_id} 在 guild_id {guild_id} 的个人消息已达到 {PERSONAL_MEMORY_CONFIG['summary_threshold']} 条，触发总结。")
-        log.debug(f"=== 开始为用户 {user_id} 在 guild_id {guild_id} 生成个人记忆摘要 ===")
-        
+        # 生产环境通常关闭 DEBUG，提前判断一次，避免无谓地构建大段调试字符串
+        debug_enabled = log.isEnabledFor(logging.DEBUG)
+        if debug_enabled:
+            log.debug(f"=== 开始为用户 {user_id} 在 guild_id {guild_id} 生成个人记忆摘要 ===")
+            log.debug(f"步骤 1: 正在为用户 {user_id} 获取 guild_id {guild_id} 的对话历史...")
+
         # 1. 获取对话历史
-        log.debug(f"步骤 1: 正在为用户 {user_id} 获取 guild_id {guild_id} 的对话历史...")
         context = await self.db_manager.get_ai_conversation_context(user_id, guild_id)
         
         if not context:
             log.warning(f"用户 {user_id} 在 guild_id {guild_id} 没有对话上下文记录。")
             return
             
-        log.debug(f"获取到的上下文结构: {list(context.keys()) if context else 'None'}")
+        if debug_enabled:
+            log.debug(f"获取到的上下文结构: {list(context.keys()) if context else 'None'}")
             
         if not context or not context['conversation_history']:
             log.warning(f"用户 {user_id} 在 guild_id {guild_id} 没有可供总结的对话历史。")
-            log.debug(f"对话历史内容: {context['conversation_history'] if context else 'No context'}")
+            if debug_enabled:
+                log.debug(f"对话历史内容: {context['conversation_history'] if context else 'No context'}")
             return
 
         conversation_history = context['conversation_history']
-        log.debug(f"对话历史长度: {len(conversation_history)} 条消息")
+        if debug_enabled:
+            log.debug(f"对话历史长度: {len(conversation_history)} 条消息")
         
         # 2. 格式化对话历史为纯文本
-        dialogue_text = ""
+        dialogue_lines = []
         for i, turn in enumerate(conversation_history):
             role = "用户" if turn.get('role') == 'user' else '模型'
-            parts = turn.get('parts', [])
-            content = " ".join(str(p) for p in parts if isinstance(p, str))
+            content = " ".join(p for p in turn.get('parts', ()) if isinstance(p, str))
             if content:
-                dialogue_text += f"{role}: {content}\n"
-            log.debug(f"消息 {i+1}: {role} - {content[:50]}...")
+                dialogue_lines.append(f"{role}: {content}\n")
+            if debug_enabled:
+                log.debug(f"消息 {i+1}: {role} - {content[:50]}...")
+        dialogue_text = "".join(dialogue_lines)
 
         if not dialogue_text.strip():
             log.warning(f"用户 {user_id} 的对话历史为空或格式不正确，无法总结。")
-            log.debug(f"原始对话历史: {conversation_history}")
+            if debug_enabled:
+                log.debug(f"原始对话历史: {conversation_history}")
             return
             
-        log.debug(f"格式化后的对话文本长度: {len(dialogue_text)} 字符")
+        if debug_enabled:
+            log.debug(f"格式化后的对话文本长度: {len(dialogue_text)} 字符")
             
         # 3. 获取旧摘要
         user_profile = await self.db_manager.get_user_profile(user_id)
         old_summary = user_profile['personal_summary'] if user_profile and user_profile['personal_summary'] else '无'
-        log.debug(f"获取到用户 {user_id} 的过往记忆摘要，长度: {len(old_summary)} 字符")
-        log.debug(f"[MEMORY_SUMMARY] 过往记忆摘要:\n--- OLD SUMMARY ---\n{old_summary}\n-------------------")
+        if debug_enabled:
+            log.debug(f"获取到用户 {user_id} 的过往记忆摘要，长度: {len(old_summary)} 字符")
+            log.debug(f"[MEMORY_SUMMARY] 过往记忆摘要:\n--- OLD SUMMARY ---\n{old_summary}\n-------------------")
 
         # 4. 构建 Prompt 并调用 AI 生成摘要
         prompt_template = PROMPT_CONFIG.get("personal_memory_summary")
@@ -236,11 +286,11 @@ class PersonalMemoryService:
             old_summary=old_summary,
             dialogue_history=dialogue_text
         )
-        log.debug(f"[MEMORY_SUMMARY] 用于总结的近期对话:\n--- DIALOGUE HISTORY ---\n{dialogue_text}\n------------------------")
-        log.debug(f"步骤 2: 构建分层总结Prompt完成，长度: {len(final_prompt)} 字符")
-        log.debug(f"完整Prompt预览: {final_prompt[:300]}...")
-        
-        log.debug("步骤 3: 调用AI生成精炼摘要...")
+        if debug_enabled:
+            log.debug(f"[MEMORY_SUMMARY] 用于总结的近期对话:\n--- DIALOGUE HISTORY ---\n{dialogue_text}\n------------------------")
+            log.debug(f"步骤 2: 构建分层总结Prompt完成，长度: {len(final_prompt)} 字符")
+            log.debug(f"完整Prompt预览: {final_prompt[:300]}...")
+            log.debug("步骤 3: 调用AI生成精炼摘要...")
         # 调用增强后的 simple_response 函数，传入完整的配置和模型名称
         new_summary = await gemini_service.generate_simple_response(
             prompt=final_prompt,
@@ -248,40 +298,31 @@ class PersonalMemoryService:
             model_name=SUMMARY_MODEL
         )
         
-        # 5. 保存摘要到数据库
+        # 5. 保存摘要到数据库，并重置计数器
         if new_summary:
-            log.debug(f"步骤 4: 成功为用户 {user_id} 生成新的精炼摘要，长度: {len(new_summary)} 字符")
-            log.debug(f"新摘要内容预览: {new_summary[:150]}...")
-            log.debug(f"[MEMORY_SUMMARY] AI生成的新摘要:\n--- NEW SUMMARY ---\n{new_summary}\n-------------------")
+            if debug_enabled:
+                log.debug(f"步骤 4: 成功为用户 {user_id} 生成新的精炼摘要，长度: {len(new_summary)} 字符")
+                log.debug(f"新摘要内容预览: {new_summary[:150]}...")
+                log.debug(f"[MEMORY_SUMMARY] AI生成的新摘要:\n--- NEW SUMMARY ---\n{new_summary}\n-------------------")
             
-            # 使用新摘要完全替换旧摘要
-            await self.db_manager.update_personal_summary(user_id, new_summary)
-            log.info(f"已成功为用户 {user_id} 更新记忆摘要。")
+            # 使用新摘要完全替换旧摘要，并在同一事务中重置计数器
+            await self.db_manager.save_personal_summary_and_reset_count(user_id, guild_id, new_summary)
+            self.invalidate_memory_cache(user_id)
             log.info(f"步骤 5: 成功为用户 {user_id} 生成并覆盖保存了新的个人记忆摘要。")
         else:
             log.error(f"为用户 {user_id} 生成个人记忆摘要失败。AI服务返回空结果。")
-            
-        # 无论总结成功与否，都重置计数器
-        await self.reset_message_count(user_id, guild_id)
-        log.debug(f"步骤 6: 已重置用户 {user_id} 在 guild_id {guild_id} 的消息计数器。")
-            
-        log.debug(f"=== 用户 {user_id} 的个人记忆摘要生成过程结束 ===")
+            # 总结失败时同样重置计数器
+            await self.reset_message_count(user_id, guild_id)
+        if debug_enabled:
+            log.debug(f"步骤 6: 已重置用户 {user_id} 在 guild_id {guild_id} 的消息计数器。")
+            log.debug(f"=== 用户 {user_id} 的个人记忆摘要生成过程结束 ===")
 
 
     async def unlock_feature(self, user_id: int):
         """为用户直接解锁个人记忆功能。"""
-        # 首先检查用户是否存在，如果不存在则创建用户记录
-        user_profile = await self.db_manager.get_user_profile(user_id)
-        if not user_profile:
-            # 用户不存在，先插入记录
-            insert_query = "INSERT INTO users (user_id, has_personal_memory, personal_summary) VALUES (?, 1, NULL)"
-            await self.db_manager._execute(self.db_manager._db_transaction, insert_query, (user_id,), commit=True)
-            log.info(f"已为用户 {user_id} 创建记录并解锁个人记忆功能。")
-        else:
-            # 用户已存在，更新记录
-            update_query = "UPDATE users SET has_personal_memory = 1 WHERE user_id = ?"
-            await self.db_manager._execute(self.db_manager._db_transaction, update_query, (user_id,), commit=True)
-            log.info(f"已为用户 {user_id} 解锁个人记忆功能。")
+        # 单条 UPSERT：用户不存在则创建记录，已存在则直接更新标记
+        await self.db_manager.upsert_unlock_personal_memory(user_id)
+        log.info(f"已为用户 {user_id} 解锁个人记忆功能。")
         
         # 注意：由于我们没有 discord.Member 对象，我们无法直接发送私信提示用户创建档案。
         # 这个提示将在用户下次与机器人互动时触发（例如，通过 /个人档案 命令或在聊天中）。
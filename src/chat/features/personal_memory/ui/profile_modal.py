@@ -1,9 +1,46 @@
 import discord
 import logging
+from typing import Any, Dict, List
 
 log = logging.getLogger(__name__)
 
 PROFILE_MODAL_CUSTOM_ID = "personal_profile_edit_modal"
+# 模态框中固定的档案字段，与各 TextInput 的 custom_id 一一对应
+PROFILE_FIELDS = ("name", "personality", "background", "preferences")
+
+
+def parse_profile_modal(data: dict) -> Dict[str, str]:
+    """
+    从模态框提交的原始交互数据中解析个人档案字段。
+    返回包含 name / personality / background / preferences 的字典，值已去除首尾空白。
+    """
+    profile_data = dict.fromkeys(PROFILE_FIELDS, "")
+    for row in data.get("components", ()):
+        for component in row.get("components", ()):
+            custom_id = component.get("custom_id")
+            if custom_id in profile_data:
+                profile_data[custom_id] = (component.get("value") or "").strip()
+    return profile_data
+
+
+def truncate_field(text: str, limit: int) -> str:
+    """截断过长的 Embed 字段值，超出部分以省略号表示。"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def build_profile_embed_fields(profile_data: Dict[str, str]) -> List[Dict[str, Any]]:
+    """根据解析后的个人档案构建审核消息的 Embed 字段列表，可选字段为空时跳过。"""
+    return [
+        {"name": field_name, "value": truncate_field(profile_data[key], limit), "inline": inline}
+        for field_name, key, limit, inline in (
+            ("名称", "name", 50, True),
+            ("性格特点", "personality", 300, False),
+            ("背景信息", "background", 200, False),
+            ("喜好偏好", "preferences", 200, False),
+        )
+        if key in ("name", "personality") or profile_data[key]
+    ]
+
 
 class ProfileEditModal(discord.ui.Modal, title="创建你的个人记忆档案"):
     """
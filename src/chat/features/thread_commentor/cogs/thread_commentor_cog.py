@@ -4,7 +4,10 @@ import logging
 import discord
 from discord.ext import commands
 import asyncio
+import random
+from collections import defaultdict
 
+from src.chat.config import chat_config
 from src.chat.features.thread_commentor.services.thread_commentor_service import thread_commentor_service
 from src.chat.features.chat_settings.services.chat_settings_service import chat_settings_service
 
@@ -15,6 +18,10 @@ class ThreadCommentorCog(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # 按论坛频道限制同时生成评价的数量，避免发帖高峰时集中调用 API
+        self._parent_semaphores = defaultdict(
+            lambda: asyncio.Semaphore(chat_config.THREAD_COMMENTOR_CONFIG["MAX_CONCURRENT_PER_CHANNEL"])
+        )
 
     @commands.Cog.listener()
     async def on_thread_create(self, thread: discord.Thread):
@@ -42,20 +49,21 @@ class ThreadCommentorCog(commands.Cog):
         log.info(f"帖子作者: {user_nickname} (ID: {user_id})")
 
         # 添加一个随机延迟，让回复看起来更自然
-        delay = 15
-        log.info(f"等待 {delay} 秒后发送评价...")
+        delay = random.uniform(*chat_config.THREAD_COMMENTOR_CONFIG["DELAY_SECONDS"])
+        log.info(f"等待 {delay:.1f} 秒后发送评价...")
         await asyncio.sleep(delay)
 
         try:
-            # 4. 调用服务生成评价，并传递用户信息
-            praise_text = await thread_commentor_service.praise_new_thread(thread, user_id, user_nickname)
+            async with self._parent_semaphores[thread.parent_id]:
+                # 4. 调用服务生成评价，并传递用户信息
+                praise_text = await thread_commentor_service.praise_new_thread(thread, user_id, user_nickname)
 
-            # 5. 如果成功生成，则发送到帖子
-            if praise_text:
-                await thread.send(praise_text)
-                log.info(f"成功发送对帖子 '{thread.name}' 的评价。")
-            else:
-                log.warning(f"未能为帖子 '{thread.name}' 生成评价，或评价为空。")
+                # 5. 如果成功生成，则发送到帖子
+                if praise_text:
+                    await thread.send(praise_text)
+                    log.info(f"成功发送对帖子 '{thread.name}' 的评价。")
+                else:
+                    log.warning(f"未能为帖子 '{thread.name}' 生成评价，或评价为空。")
 
         except Exception as e:
             log.error(f"处理帖子 '{thread.name}' 时发生未知错误: {e}", exc_info=True)
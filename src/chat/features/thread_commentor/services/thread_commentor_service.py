@@ -1,86 +1,294 @@
  # -*- coding: utf-8 -*-
 
 import logging
-import discord
-from typing import Optional
+import asyncio
 import sqlite3
-import json
+import discord
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
 import os
 
 from src import config
+from src.chat.config import chat_config
 from src.chat.services.gemini_service import gemini_service
 from src.chat.config.thread_prompts import THREAD_PRAISE_PROMPT
 from src.chat.services.prompt_service import JAILBREAK_USER_PROMPT, JAILBREAK_MODEL_RESPONSE, JAILBREAK_FINAL_INSTRUCTION
 from datetime import datetime, timezone, timedelta
-from src.chat.utils.prompt_utils import replace_emojis, get_thread_commentor_persona
+from src.chat.utils.prompt_utils import replace_emojis, get_thread_commentor_persona, truncate_utf8
 from src.chat.utils.database import chat_db_manager
+from src.chat.utils import json_utils
+from src.chat.utils.sqlite_pool import get_pool
 from src.chat.features.odysseia_coin.service.coin_service import coin_service
 from src.chat.features.world_book.services.world_book_service import world_book_service
+from src.chat.features.world_book.database.world_book_db_manager import world_book_db_manager
+from src.chat.features.personal_memory.services.personal_memory_service import personal_memory_service
 
 log = logging.getLogger(__name__)
 
+# 批量读取的最长等待时间（秒）与单批最大键数
+BATCH_MAX_WAIT = 0.02
+BATCH_MAX_SIZE = 32
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 帖子正文与单个 RAG 条目注入提示词时的最大 UTF-8 字节数（约 1500 个汉字 / 500 个汉字）
+MAX_CONTENT_BYTES = 4500
+MAX_RAG_ENTRY_BYTES = 1500
+
+# 注入 RAG 背景知识时的开头说明
+RAG_CONTEXT_HEADER = "为了帮助你更好地理解帖子中可能提到的社区术语，这里有一些相关的背景知识："
+
+
+# 对话历史中固定不变的开头部分 (role, text)，每次调用时据此生成新的消息字典，避免共享可变对象
+_STATIC_PREFIX = (
+    ("user", JAILBREAK_USER_PROMPT),
+    ("model", JAILBREAK_MODEL_RESPONSE),
+    ("user", get_thread_commentor_persona()),
+    ("model", "好的，我是类脑娘，已经准备好了"),
+)
+
+
+@lru_cache(maxsize=256)
+def _task_prompt(user_nickname: str) -> str:
+    """按用户昵称缓存格式化后的暖贴任务提示词。"""
+    return THREAD_PRAISE_PROMPT.format(user_nickname=user_nickname)
+
+
+@lru_cache(maxsize=4)
+def _final_instruction(minute_bucket: int) -> str:
+    """按分钟缓存注入了当前北京时间的最终指令，同一分钟内的帖子共用同一字符串。"""
+    current_beijing_time = datetime.fromtimestamp(minute_bucket * 60, BEIJING_TZ).strftime('%Y年%m月%d日 %H:%M')
+    return JAILBREAK_FINAL_INSTRUCTION.format(current_time=current_beijing_time)
+
+
+class BatchReader:
+    """
+    将短时间内对同一数据源的多次单键查询合并为一次批量查询。
+    第一个请求到达后最多等待 max_wait 秒，或攒满 max_batch 个键时立即执行；
+    fetch_many 接收键列表，返回 {键: 值} 字典，缺失的键对应 None。
+    """
+
+    def __init__(
+        self,
+        fetch_many: Callable[[List[Any]], Awaitable[Dict[Any, Any]]],
+        max_wait: float = BATCH_MAX_WAIT,
+        max_batch: int = BATCH_MAX_SIZE,
+    ):
+        self._fetch_many = fetch_many
+        self._max_wait = max_wait
+        self._max_batch = max_batch
+        self._pending: Dict[Any, List[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get(self, key: Any) -> Any:
+        """把键加入当前批次，并等待该批次的查询结果。"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[Any, List[asyncio.Future]]):
+        try:
+            results = await self._fetch_many(list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for key, futures in batch.items():
+            value = results.get(key)
+            for future in futures:
+                if not future.done():
+                    future.set_result(value)
+
+
 class ThreadCommentorService:
     """处理新帖子评价功能的服务"""
 
     def __init__(self):
         self.world_book_db_path = os.path.join(config.DATA_DIR, 'world_book.sqlite3')
+        # 新帖集中出现时，把多位作者的档案/摘要查询合并为一次 IN 查询
+        self._profile_reader = BatchReader(self._fetch_profiles)
+        self._summary_reader = BatchReader(chat_db_manager.get_personal_summaries)
+        # 同一用户正在进行中的记忆加载，并发请求共享同一个任务（single-flight）
+        self._memory_loads: Dict[int, asyncio.Task] = {}
+
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个世界书数据库连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(self.world_book_db_path)
+        try:
+            conn = pool.acquire()
+        except sqlite3.Error as e:
+            log.error(f"连接到世界书数据库失败: {e}", exc_info=True)
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    async def _fetch_profiles(self, discord_ids: List[str]) -> Dict[str, Optional[str]]:
+        """批量查询多位用户在世界书中的档案 content_json（在线程中执行，不阻塞事件循环）。"""
+        return await asyncio.to_thread(self._select_profiles, discord_ids)
+
+    def _select_profiles(self, discord_ids: List[str]) -> Dict[str, Optional[str]]:
+        """_fetch_profiles 的同步实现"""
+        with self._conn() as conn:
+            if not conn:
+                return {}
+
+            placeholders = ", ".join("?" for _ in discord_ids)
+            profiles: Dict[str, Optional[str]] = {}
+            for row in conn.execute(
+                f"SELECT discord_number_id, content_json FROM community_members WHERE discord_number_id IN ({placeholders})",
+                discord_ids
+            ):
+                profiles.setdefault(row['discord_number_id'], row['content_json'])
+            return profiles
 
     async def _get_user_memory(self, user_id: int) -> str:
         """
         从世界书和主数据库中获取用户的个人记忆。
+        结果会缓存一段时间，档案或摘要更新时由 PersonalMemoryService 使缓存失效。
         """
-        memory_parts = []
+        cached_memory = personal_memory_service.get_cached_memory(user_id)
+        if cached_memory is not None:
+            return cached_memory
 
-        # 1. 从世界书数据库获取用户档案
-        try:
-            with sqlite3.connect(self.world_book_db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT content_json FROM community_members WHERE discord_number_id = ?",
-                    (str(user_id),)
-                )
-                row = cursor.fetchone()
-                if row and row['content_json']:
-                    profile = json.loads(row['content_json'])
-                    profile_text = (
-                        f"用户的公开档案：\n"
-                        f"- 昵称: {profile.get('name', '未知')}\n"
-                        f"- 性格: {profile.get('personality', '未知')}\n"
-                        f"- 背景: {profile.get('background', '未知')}\n"
-
-                        f"- 偏好: {profile.get('preferences', '未知')}"
-                    )
-                    memory_parts.append(profile_text)
-        except Exception as e:
-            log.error(f"从世界书数据库为用户 {user_id} 获取档案时出错: {e}")
+        load_task = self._memory_loads.get(user_id)
+        if load_task is None:
+            load_task = asyncio.create_task(self._load_user_memory(user_id))
+            self._memory_loads[user_id] = load_task
+            load_task.add_done_callback(lambda _: self._memory_loads.pop(user_id, None))
+        # shield 防止某个等待方被取消时连带取消其他请求共享的加载任务
+        return await asyncio.shield(load_task)
+
+    async def _fetch_world_book_profile(self, user_id: int) -> Optional[str]:
+        """从世界书数据库获取用户档案，并格式化为记忆文本。"""
+        content_json = await self._profile_reader.get(str(user_id))
+        if not content_json:
+            return None
+        profile = json_utils.loads(content_json)
+        return (
+            f"用户的公开档案：\n"
+            f"- 昵称: {profile.get('name', '未知')}\n"
+            f"- 性格: {profile.get('personality', '未知')}\n"
+            f"- 背景: {profile.get('background', '未知')}\n"
+
+            f"- 偏好: {profile.get('preferences', '未知')}"
+        )
+
+    async def _fetch_personal_summary(self, user_id: int) -> Optional[str]:
+        """从主数据库获取用户的对话摘要，并格式化为记忆文本。"""
+        personal_summary = await self._summary_reader.get(user_id)
+        if not personal_summary:
+            return None
+        return f"我与该用户的过往对话摘要：\n{personal_summary}"
+
+    async def _load_user_memory(self, user_id: int) -> str:
+        """并发查询用户的档案与对话摘要并拼接，查询全部成功时结果写入缓存。"""
+        profile_text, summary_text = await asyncio.gather(
+            self._fetch_world_book_profile(user_id),
+            self._fetch_personal_summary(user_id),
+            return_exceptions=True
+        )
+
+        load_failed = False
+        if isinstance(profile_text, Exception):
+            log.error(f"从世界书数据库为用户 {user_id} 获取档案时出错: {profile_text}")
+            profile_text, load_failed = None, True
+        if isinstance(summary_text, Exception):
+            log.error(f"从主数据库为用户 {user_id} 获取摘要时出错: {summary_text}")
+            summary_text, load_failed = None, True
+
+        memory_parts = [part for part in (profile_text, summary_text) if part]
+        if memory_parts:
+            memory = "\n\n---\n\n".join(memory_parts)
+        else:
+            memory = "关于这位用户，我暂时还没有任何记忆。"
+        # 查询出错时不缓存不完整的结果，下次请求重新加载
+        if not load_failed:
+            personal_memory_service.cache_memory(user_id, memory)
+        return memory
 
-        # 2. 从主数据库获取对话摘要
+    async def _should_run_rag(self, content: str) -> bool:
+        """
+        廉价的 RAG 预筛选：内容过短，或未提及任何世界书术语时，跳过嵌入生成与向量搜索。
+        术语索引为空（尚未建立或加载失败）时不做过滤，保持原有行为。
+        """
+        if len(content) < chat_config.THREAD_COMMENTOR_CONFIG["RAG_MIN_CONTENT_LENGTH"]:
+            return False
+        await world_book_db_manager.ensure_term_index()
+        titles, aliases = world_book_db_manager.titles, world_book_db_manager.alias_index
+        if not titles and not aliases:
+            return True
+        lowered = content.lower()
+        # 单字术语几乎总能命中，不具备区分度
+        return any(len(term) > 1 and term in lowered for term in chain(titles, aliases))
+
+    async def _search_rag_context(self, thread_full_content: str, title: str, user_id: int, guild_id: int, user_nickname: str) -> str:
+        """调用 RAG 服务搜索与帖子相关的世界书条目，返回可直接注入对话的背景知识文本。"""
         try:
-            user_profile = await chat_db_manager.get_user_profile(user_id)
-            if user_profile and user_profile['personal_summary']:
-                summary_text = f"我与该用户的过往对话摘要：\n{user_profile['personal_summary']}"
-                memory_parts.append(summary_text)
-        except Exception as e:
-            log.error(f"从主数据库为用户 {user_id} 获取摘要时出错: {e}")
+            if not await self._should_run_rag(thread_full_content):
+                log.info(f"帖子 '{title}' 内容过短或未提及世界书术语，跳过 RAG 搜索。")
+                return ""
 
-        if not memory_parts:
-            return "关于这位用户，我暂时还没有任何记忆。"
-        
-        return "\n\n---\n\n".join(memory_parts)
+            log.info(f"开始为帖子 '{title}' 的内容进行 RAG 搜索...")
+            rag_results = await world_book_service.find_entries(
+                latest_query=thread_full_content,
+                user_id=user_id,
+                guild_id=guild_id,
+                user_name=user_nickname,
+                n_results=3, # 最多获取3个相关条目
+                max_distance=0.7
+            )
+            if not rag_results:
+                log.info(f"RAG 搜索没有为帖子 '{title}' 找到相关条目。")
+                return ""
+
+            log.info(f"RAG 搜索成功，为帖子 '{title}' 找到了 {len(rag_results)} 个相关条目。")
+            return RAG_CONTEXT_HEADER + "\n" + "\n".join(
+                f"- **{result.get('metadata', {}).get('title', '未知标题')}**: "
+                f"{truncate_utf8(result.get('content') or '无内容', MAX_RAG_ENTRY_BYTES)}"
+                for result in rag_results
+            )
+        except Exception as e:
+            log.error(f"为帖子 '{title}' 进行 RAG 搜索时发生错误: {e}", exc_info=True)
+            return ""
 
     async def praise_new_thread(self, thread: discord.Thread, user_id: int, user_nickname: str) -> Optional[str]:
         """
         针对新创建的帖子生成一段结合用户记忆的个性化夸奖。
         """
         try:
-            # 检查用户是否禁用了暖贴功能
-            if await coin_service.has_withered_sunflower(user_id):
+            # 一次查询同时检查用户是否禁用了暖贴功能或帖子回复功能
+            withered, blocked = await coin_service.get_reply_flags(user_id)
+            if withered:
                 log.info(f"用户 {user_id} 已禁用暖贴功能，跳过对帖子 '{thread.name}' 的评价。")
                 return None
-
-            # 检查用户是否禁用了帖子回复功能
-            if await coin_service.blocks_thread_replies(user_id):
+            if blocked:
                 log.info(f"用户 {user_id} 已禁用帖子回复功能，跳过对帖子 '{thread.name}' 的评价。")
                 return None
 
@@ -96,57 +304,27 @@ class ThreadCommentorService:
 
             # 2. 准备帖子内容
             title = thread.name
-            tags = ", ".join([tag.name for tag in thread.applied_tags])
-            content = first_message.content
-            max_content_length = 1500
-            if len(content) > max_content_length:
-                content = content[:max_content_length] + "..."
+            tags = ", ".join(tag.name for tag in thread.applied_tags)
+            content = truncate_utf8(first_message.content, MAX_CONTENT_BYTES)
             thread_full_content = f"标题: {title}\n标签: {tags}\n内容: {content}"
 
-            # 3. 获取用户记忆
-            user_memory = await self._get_user_memory(user_id)
-
-            # 4. 新增：调用 RAG 服务进行世界书搜索
-            rag_context = ""
-            try:
-                log.info(f"开始为帖子 '{title}' 的内容进行 RAG 搜索...")
-                rag_results = await world_book_service.find_entries(
-                    latest_query=thread_full_content,
-                    user_id=user_id,
-                    guild_id=thread.guild.id,
-                    user_name=user_nickname,
-                    n_results=3, # 最多获取3个相关条目
-                    max_distance=0.7
-                )
-                if rag_results:
-                    rag_context_parts = ["为了帮助你更好地理解帖子中可能提到的社区术语，这里有一些相关的背景知识："]
-                    for result in rag_results:
-                        entry_title = result.get('metadata', {}).get('title', '未知标题')
-                        entry_content = result.get('document', '无内容')
-                        rag_context_parts.append(f"- **{entry_title}**: {entry_content}")
-                    
-                    rag_context = "\n".join(rag_context_parts)
-                    log.info(f"RAG 搜索成功，为帖子 '{title}' 找到了 {len(rag_results)} 个相关条目。")
-                else:
-                    log.info(f"RAG 搜索没有为帖子 '{title}' 找到相关条目。")
-            except Exception as e:
-                log.error(f"为帖子 '{title}' 进行 RAG 搜索时发生错误: {e}", exc_info=True)
-
-            # 5. 准备调用所需的所有信息片段
-            core_persona = get_thread_commentor_persona()
-            task_prompt = THREAD_PRAISE_PROMPT.format(user_nickname=user_nickname)
+            # 3. 并发获取用户记忆与 RAG 世界书搜索结果，两者互不依赖
+            user_memory, rag_context = await asyncio.gather(
+                self._get_user_memory(user_id),
+                self._search_rag_context(thread_full_content, title, user_id, thread.guild.id, user_nickname)
+            )
+
+            # 4. 准备调用所需的所有信息片段
+            task_prompt = _task_prompt(user_nickname)
 
             log.info(f"为帖子 '{title}' 构建带有破限功能的统一上下文，即将调用AI服务。")
 
-            # 6. 手动构建带有“破限”逻辑的对话历史
-            conversation_history = [
-                {"role": "user", "parts": [JAILBREAK_USER_PROMPT]},
-                {"role": "model", "parts": [JAILBREAK_MODEL_RESPONSE]},
-                {"role": "user", "parts": [core_persona]},
-                {"role": "model", "parts": ["好的，我是类脑娘，已经准备好了"]},
+            # 5. 手动构建带有“破限”逻辑的对话历史
+            conversation_history = [{"role": role, "parts": [text]} for role, text in _STATIC_PREFIX]
+            conversation_history.extend([
                 {"role": "user", "parts": [user_memory]},
                 {"role": "model", "parts": ["关于你的事情，我当然都记得"]},
-            ]
+            ])
             
             # 如果有 RAG 结果，则注入
             if rag_context:
@@ -159,9 +337,8 @@ class ThreadCommentorService:
             ])
             
             # 注入最终指令到最后一条 model 消息
-            beijing_tz = timezone(timedelta(hours=8))
-            current_beijing_time = datetime.now(beijing_tz).strftime('%Y年%m月%d日 %H:%M')
-            final_injection_content = JAILBREAK_FINAL_INSTRUCTION.format(current_time=current_beijing_time)
+            minute_bucket = int(datetime.now(BEIJING_TZ).timestamp() // 60)
+            final_injection_content = _final_instruction(minute_bucket)
             
             last_model_message = conversation_history[-1]
             if last_model_message["role"] == "model" and last_model_message["parts"]:
@@ -170,7 +347,7 @@ class ThreadCommentorService:
             # 添加最终的用户输入（帖子内容）
             conversation_history.append({"role": "user", "parts": [thread_full_content]})
 
-            # 7. 调用重构后的 Gemini 服务方法
+            # 6. 调用重构后的 Gemini 服务方法
             praise_text = await gemini_service.generate_thread_praise(
                 conversation_history=conversation_history
             )
@@ -1,6 +1,10 @@
 import discord
 import aiohttp
-from typing import Dict, Any, Optional
+import asyncio
+from collections import OrderedDict
+from pathlib import PurePosixPath
+from urllib.parse import urlparse
+from typing import Dict, Any, Optional, Tuple
 from src.chat.features.tools.tool_registry import register_tool
 
 # 为 get_user_avatar 工具定义 Schema
@@ -14,6 +18,62 @@ GET_USER_AVATAR_SCHEMA = {
     }
 }
 
+# 按头像 URL 的文件后缀推断 MIME 类型，未知后缀时使用 image/jpeg
+AVATAR_MIME_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+# 请求的头像尺寸：只用于让模型观察，不需要 Discord 默认的 1024px 原图
+AVATAR_REQUEST_SIZE = 256
+
+# 头像缓存：键为 (用户ID, 头像哈希)，头像更换后哈希变化，旧条目自然失效
+AVATAR_CACHE_MAXSIZE = 512
+AVATAR_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_avatar_cache: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+_avatar_cache_bytes = 0
+
+
+def _cache_avatar(key: Tuple[int, str], image_data: Dict[str, Any]):
+    """写入头像缓存，超出数量或总字节数上限时淘汰最久未使用的条目。"""
+    global _avatar_cache_bytes
+    old = _avatar_cache.pop(key, None)
+    if old is not None:
+        _avatar_cache_bytes -= len(old["data"])
+    _avatar_cache[key] = image_data
+    _avatar_cache_bytes += len(image_data["data"])
+    while len(_avatar_cache) > AVATAR_CACHE_MAXSIZE or _avatar_cache_bytes > AVATAR_CACHE_MAX_BYTES:
+        _, evicted = _avatar_cache.popitem(last=False)
+        _avatar_cache_bytes -= len(evicted["data"])
+
+
+# 复用同一个 HTTP 会话下载头像，保留与 Discord CDN 的长连接和 DNS 缓存
+_session: Optional[aiohttp.ClientSession] = None
+_session_lock = asyncio.Lock()
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话，首次调用或会话已关闭时创建。"""
+    global _session
+    if _session is None or _session.closed:
+        async with _session_lock:
+            if _session is None or _session.closed:
+                connector = aiohttp.TCPConnector(limit=50, ttl_dns_cache=300, keepalive_timeout=60)
+                _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_session():
+    """关闭共享的 aiohttp 会话，在机器人下线时调用。"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
 @register_tool(name="get_user_avatar", schema=GET_USER_AVATAR_SCHEMA)
 async def get_user_avatar(bot: Optional[discord.Client] = None, author_id: Optional[int] = None) -> Dict[str, Any]:
     """
@@ -33,29 +93,37 @@ async def get_user_avatar(bot: Optional[discord.Client] = None, author_id: Optio
         return {"error": "Author ID was not provided by the service."}
 
     try:
-        user = await bot.fetch_user(author_id)
+        # 优先使用 gateway 维护的用户缓存，未命中时才调用 REST API
+        user = bot.get_user(author_id) or await bot.fetch_user(author_id)
         if not user or not user.avatar:
             return {"error": f"User with ID {author_id} not found or has no avatar."}
 
-        avatar_url = user.avatar.url
-        async with aiohttp.ClientSession() as session:
-            async with session.get(str(avatar_url)) as response:
-                if response.status == 200:
-                    image_bytes = await response.read()
-                    # 从URL推断MIME类型，或直接使用常见的默认值
-                    mime_type = 'image/png' if 'png' in str(avatar_url) else 'image/jpeg'
-                    if 'gif' in str(avatar_url):
-                        mime_type = 'image/gif'
-                    
-                    # 返回一个特殊结构的字典，ToolService将用它来构建多模态响应
-                    return {
-                        "image_data": {
-                            "mime_type": mime_type,
-                            "data": image_bytes
-                        }
-                    }
-                else:
-                    return {"error": f"Failed to download avatar. Status: {response.status}"}
+        cache_key = (author_id, user.avatar.key)
+        cached = _avatar_cache.get(cache_key)
+        if cached is not None:
+            _avatar_cache.move_to_end(cache_key)
+            return {"image_data": cached}
+
+        # 统一请求静态 PNG（动图取首帧，Gemini 不接受 GIF 输入）与较小尺寸，减少下载字节数
+        avatar_url = str(user.avatar.replace(size=AVATAR_REQUEST_SIZE, format='png').url)
+        session = await _get_session()
+        async with session.get(avatar_url) as response:
+            if response.status == 200:
+                image_bytes = await response.read()
+                # 从URL路径的文件后缀推断MIME类型
+                suffix = PurePosixPath(urlparse(avatar_url).path).suffix.lower()
+                mime_type = AVATAR_MIME_TYPES.get(suffix, 'image/jpeg')
+                
+                image_data = {
+                    "mime_type": mime_type,
+                    "data": image_bytes
+                }
+                _cache_avatar(cache_key, image_data)
+
+                # 返回一个特殊结构的字典，ToolService将用它来构建多模态响应
+                return {"image_data": image_data}
+            else:
+                return {"error": f"Failed to download avatar. Status: {response.status}"}
 
     except discord.NotFound:
         return {"error": f"User with ID {author_id} not found in Discord."}
@@ -1,6 +1,5 @@
 from google.genai import types
 import discord
-import inspect
 from typing import Optional
 import logging
 from src.chat.features.tools.tool_registry import tool_registry
@@ -32,25 +31,28 @@ class ToolService:
             tool_info = tool_registry.get_tool(tool_name)
             tool_function = tool_info["function"]
 
-            # 提取工具调用的参数
-            tool_args = dict(tool_call.args)
+            # 提取工具调用的参数；无参数的工具调用 args 可能为 None
+            tool_args = dict(tool_call.args or ())
 
-            # 检查工具函数签名，并根据需要注入上下文依赖
-            sig = inspect.signature(tool_function)
-            if 'bot' in sig.parameters:
+            # 根据注册时缓存的函数签名信息，按需注入上下文依赖
+            if tool_info["accepts_bot"]:
                 tool_args['bot'] = bot
-            if 'author_id' in sig.parameters and author_id is not None:
+            if tool_info["accepts_author_id"] and author_id is not None:
                 tool_args['author_id'] = author_id
 
             # 执行工具函数
             result = await tool_function(**tool_args)
-            log.info(f"工具 '{tool_name}' 已执行，参数: {tool_args}, 返回结果: {result}")
+            log.info(f"工具 '{tool_name}' 已执行。")
+            # 返回结果可能包含图片等大块二进制数据，只在 DEBUG 级别下才格式化输出
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f"工具 '{tool_name}' 参数: {tool_args}, 返回结果: {result}")
             
             part = types.Part.from_function_response(
                 name=tool_name,
                 response={"result": result} # 根据文档，response 需要一个包含 "result" 键的字典
             )
-            log.info(f"正在将构造好的 Part 返回给 gemini_service: {part}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f"正在将构造好的 Part 返回给 gemini_service: {part}")
             return part
 
         except ValueError as e:
@@ -1,4 +1,4 @@
-import functools
+import inspect
 from typing import Callable, Dict, Any
 import logging
 
@@ -20,7 +20,14 @@ class ToolRegistry:
             log.warning(f"工具 '{name}' 正在被重新定义。")
         else:
             log.info(f"工具 '{name}' 已成功注册。")
-        self._tools[name] = {"schema": schema, "function": func}
+        # 注册时解析一次函数签名，执行工具时直接使用缓存的上下文注入标记
+        parameters = inspect.signature(func).parameters
+        self._tools[name] = {
+            "schema": schema,
+            "function": func,
+            "accepts_bot": "bot" in parameters,
+            "accepts_author_id": "author_id" in parameters,
+        }
 
     def get_tool(self, name: str) -> Dict[str, Any]:
         """
@@ -51,8 +58,5 @@ def register_tool(name: str, schema: Dict[str, Any]):
     """
     def decorator(func: Callable):
         tool_registry.register(name, schema, func)
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
-        return wrapper
+        return func
     return decorator
\ No newline at end of file
@@ -1,8 +1,12 @@
 # src/chat/features/world_book/database/world_book_db_manager.py
 
 import aiosqlite
+import asyncio
 import logging
 from pathlib import Path
+from typing import Dict
+
+from src.chat.utils.sqlite_pool import get_pool
 
 # 设置日志记录器
 log = logging.getLogger(__name__)
@@ -10,6 +14,10 @@ log = logging.getLogger(__name__)
 # 定义数据库文件的路径
 DB_PATH = Path("data/world_book.sqlite3")
 
+# 用 GROUP_CONCAT(nickname, char(31)) 一次取出多个昵称时使用的分隔符（ASCII 单元分隔符），
+# 避免与昵称中可能出现的逗号冲突
+NICKNAME_SEPARATOR = "\x1f"
+
 # 定义数据库的完整结构 (Schema) - 从 initialize_world_book_db.py 合并而来
 # 使用 CREATE TABLE IF NOT EXISTS 来确保数据安全
 SQL_SCHEMA = """
@@ -81,8 +89,22 @@ CREATE TABLE IF NOT EXISTS "pending_entries" (
     "expires_at"    TEXT NOT NULL
 );
 
+-- 嵌入向量缓存表：键为 (模型, 标题, 文本) 的 SHA-256，向量以 float32 字节存储
+CREATE TABLE IF NOT EXISTS "embedding_cache" (
+    "text_sha256"   BLOB PRIMARY KEY,
+    "embedding" BLOB NOT NULL,
+    "created_at" DATETIME DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+
 -- 为常用查询字段创建索引
 CREATE INDEX IF NOT EXISTS "idx_community_members_discord_id" ON "community_members" ("discord_number_id");
+-- 覆盖索引：按 Discord ID + 状态查找档案ID时无需回表
+CREATE INDEX IF NOT EXISTS "idx_community_members_discord_status" ON "community_members" ("discord_number_id", "status", "id");
+-- 覆盖索引：按档案ID取昵称列表（按 Discord ID 查档案后的第二步）时无需回表
+CREATE INDEX IF NOT EXISTS "idx_member_discord_nicknames_member" ON "member_discord_nicknames" ("member_id", "nickname");
+-- 按条目ID取别名/引用关系
+CREATE INDEX IF NOT EXISTS "idx_aliases_entry_id" ON "aliases" ("entry_id");
+CREATE INDEX IF NOT EXISTS "idx_knowledge_refers_to_entry_id" ON "knowledge_refers_to" ("entry_id");
 CREATE INDEX IF NOT EXISTS "idx_pending_entries_status_expires" ON "pending_entries" ("status", "expires_at");
 """
 
@@ -93,6 +115,11 @@ class WorldBookDBManager:
     def __init__(self, db_path: Path):
         self.db_path = db_path
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 世界书术语的内存索引（键均为小写）：标题/名称 -> 条目ID，别名 -> 条目ID
+        self.titles: Dict[str, str] = {}
+        self.alias_index: Dict[str, str] = {}
+        self._index_stale = True
+        self._index_lock = asyncio.Lock()
 
     async def init_async(self):
         """
@@ -101,12 +128,54 @@ class WorldBookDBManager:
         log.info(f"正在检查并初始化 World Book 数据库: {self.db_path}...")
         try:
             async with aiosqlite.connect(self.db_path) as db:
-                await db.executescript(SQL_SCHEMA)
-                await db.commit()
+                # WAL 模式会持久化到数据库文件，之后的所有连接都可以读写并发；该设置不能在事务中修改，
+                # 因此放在事务之前。所有建表/建索引语句在同一个事务中执行，只提交一次
+                await db.executescript(f"PRAGMA journal_mode=WAL;\nBEGIN;\n{SQL_SCHEMA}\nCOMMIT;")
+            await asyncio.to_thread(self._load_term_index)
             log.info(f"World Book 数据库 '{self.db_path}' 检查完毕，所有表结构已确保存在。")
         except Exception as e:
             log.error(f"初始化 World Book 数据库时发生严重错误: {e}", exc_info=True)
             raise
 
+    def _load_term_index(self):
+        """从数据库读取已通过的通用知识标题/名称与别名，重建内存索引（在线程中执行）。"""
+        pool = get_pool(str(self.db_path))
+        conn = pool.acquire()
+        try:
+            titles: Dict[str, str] = {}
+            for entry_id, title, name in conn.execute(
+                "SELECT id, title, name FROM general_knowledge WHERE status = 'approved'"
+            ):
+                for term in (title, name):
+                    if term and term.strip():
+                        titles[term.strip().lower()] = entry_id
+
+            alias_index: Dict[str, str] = {}
+            for alias, entry_id in conn.execute("SELECT alias, entry_id FROM aliases"):
+                if alias and alias.strip():
+                    alias_index[alias.strip().lower()] = entry_id
+        finally:
+            pool.release(conn)
+
+        self.titles, self.alias_index = titles, alias_index
+        self._index_stale = False
+        log.info(f"已加载世界书术语索引: {len(titles)} 个标题/名称，{len(alias_index)} 个别名。")
+
+    async def ensure_term_index(self):
+        """确保术语索引是最新的；被标记为过期时从数据库重新加载，失败时沿用旧索引。"""
+        if not self._index_stale:
+            return
+        async with self._index_lock:
+            if not self._index_stale:
+                return
+            try:
+                await asyncio.to_thread(self._load_term_index)
+            except Exception as e:
+                log.error(f"加载世界书术语索引时发生错误: {e}", exc_info=True)
+
+    def invalidate_cache(self):
+        """标记术语索引过期。写入通用知识或别名后调用，下次读取时重新加载。"""
+        self._index_stale = True
+
 # 创建一个单例，方便在项目其他地方导入和使用
 world_book_db_manager = WorldBookDBManager(DB_PATH)
\ No newline at end of file
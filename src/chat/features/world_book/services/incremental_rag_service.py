@@ -1,12 +1,30 @@
 import logging
 import asyncio
-from typing import Dict, Any, List
+import hashlib
+import json
+import random
+import re
+from typing import Dict, Any, List, Optional
 import sqlite3
 import os
+from bisect import bisect_right
+from contextlib import contextmanager
+from functools import partial
+from itertools import accumulate
+
+import numpy as np
 
 from src import config
-from src.chat.services.gemini_service import gemini_service
+from src.chat.services.gemini_service import gemini_service, EMBEDDING_MODEL_NAME
 from src.chat.services.vector_db_service import vector_db_service
+from src.chat.utils.sqlite_pool import get_pool
+from src.chat.utils import json_utils
+from src.chat.features.world_book.database.world_book_db_manager import NICKNAME_SEPARATOR
+
+log = logging.getLogger(__name__)
+
+# 按句子分割文本。正则表达式包含中英文常见的句子结束符以及换行符。
+_SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[。？！.!?\n])\s*')
 
 # 复制必要的函数，避免导入路径问题
 def create_text_chunks(text: str, max_chars: int = 1000) -> list[str]:
@@ -14,8 +32,6 @@ def create_text_chunks(text: str, max_chars: int = 1000) -> list[str]:
     根据句子边界将长文本分割成更小的块。
     该函数会尝试创建尽可能大但不超过 max_chars 的文本块。
     """
-    import re
-    
     if not text or not text.strip():
         return []
 
@@ -25,41 +41,31 @@ def create_text_chunks(text: str, max_chars: int = 1000) -> list[str]:
     if len(text) <= max_chars:
         return [text]
 
-    # 按句子分割文本。正则表达式包含中英文常见的句子结束符以及换行符。
-    sentences = re.split(r'(?<=[。？！.!?\n])\s*', text)
+    # 按句子分割文本
+    sentences = _SENTENCE_SPLIT_PATTERN.split(text)
     sentences = [s.strip() for s in sentences if s.strip()]
     
     if not sentences:
         return []
 
+    # cumulative_lengths[k] 为前 k+1 个句子各自长度加一（连接用的空格）之和，
+    # 句子 i..j 以空格连接后的长度即 cumulative_lengths[j] - cumulative_lengths[i-1] - 1，
+    # 因此每个块的结束位置都可以通过二分查找直接定位，无需逐句累加。
+    cumulative_lengths = list(accumulate(len(sentence) + 1 for sentence in sentences))
+
     final_chunks = []
-    current_chunk = ""
-    for sentence in sentences:
-        # 如果单个句子超过 max_chars，它将自成一块。
-        # 这是一种备用策略，理想情况下应通过格式良好的源数据来避免。
-        if len(sentence) > max_chars:
-            if current_chunk:
-                final_chunks.append(current_chunk)
-            final_chunks.append(sentence)
-            current_chunk = ""
-            continue
-
-        # 如果添加下一个句子会超过 max_chars 限制，
-        # 则完成当前块并开始一个新块。
-        if len(current_chunk) + len(sentence) + 1 > max_chars: # +1 是为了空格
-            final_chunks.append(current_chunk)
-            current_chunk = sentence
+    i = 0
+    while i < len(sentences):
+        base = cumulative_lengths[i - 1] if i else 0
+        j = bisect_right(cumulative_lengths, base + max_chars + 1, i) - 1
+        if j < i:
+            # 如果单个句子超过 max_chars，它将自成一块。
+            # 这是一种备用策略，理想情况下应通过格式良好的源数据来避免。
+            final_chunks.append(sentences[i])
+            i += 1
         else:
-            # 否则，将句子添加到当前块。
-            if current_chunk:
-                current_chunk += " " + sentence
-            else:
-                current_chunk = sentence
-    
-    # 将最后一个剩余的块添加到列表中。
-    if current_chunk:
-        final_chunks.append(current_chunk)
-        
+            final_chunks.append(" ".join(sentences[i:j + 1]))
+            i = j + 1        
     return final_chunks
 
 def _format_content_dict(content_dict: dict) -> str:
@@ -123,6 +129,15 @@ def _build_text_slang(entry: dict) -> str:
         
     return "\n".join(text_parts)
 
+# 将类别映射到相应的构建函数
+_TEXT_BUILDERS = {
+    "社区成员": _build_text_community_member,
+    "社区信息": partial(_build_text_generic, category_name="社区信息"),
+    "社区文化": partial(_build_text_generic, category_name="社区文化"),
+    "社区大事件": partial(_build_text_generic, category_name="社区大事件"),
+    "俚语": _build_text_slang,
+}
+
 def build_document_text(entry: dict) -> str:
     """
     根据条目的类别，调用相应的函数来构建用于嵌入的文本文档。
@@ -130,28 +145,38 @@ def build_document_text(entry: dict) -> str:
     """
     category = entry.get("metadata", {}).get("category")
 
-    # 将类别映射到相应的构建函数
-    builders = {
-        "社区成员": _build_text_community_member,
-        "社区信息": lambda e: _build_text_generic(e, "社区信息"),
-        "社区文化": lambda e: _build_text_generic(e, "社区文化"),
-        "社区大事件": lambda e: _build_text_generic(e, "社区大事件"),
-        "俚语": _build_text_slang,
-    }
-
-    builder_func = builders.get(category)
+    builder_func = _TEXT_BUILDERS.get(category)
 
     if builder_func:
         return builder_func(entry)
     else:
         # 如果没有找到特定的构建器，则记录警告并使用默认的 content 转换
-        import logging
-        log = logging.getLogger(__name__)
         log.warning(f"条目 '{entry.get('id')}' 的类别 '{category}' 没有找到特定的文本构建器，将使用默认内容。")
         content = entry.get("content", "")
         return str(content) if isinstance(content, dict) else content
 
-log = logging.getLogger(__name__)
+# 单个条目分块后并发生成嵌入的最大请求数，以及每个请求发出前的随机抖动上限（秒）
+MAX_CONCURRENT_EMBEDS = 5
+EMBED_JITTER_SECONDS = 0.05
+_embed_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EMBEDS)
+
+# 单个条目每批生成嵌入并写入向量数据库的块数
+ADD_DOCUMENTS_BATCH_SIZE = 32
+
+# 文档文本与单个块的最小字符数，低于此长度的内容几乎不携带检索信息，不为其请求嵌入
+MIN_DOC_CHARS = 20
+MIN_CHUNK_CHARS = 8
+
+# 嵌入缓存：条目被重新处理（编辑、重试）时，未变化的块直接复用已生成的向量。
+# 键包含模型与标题，因为二者都会影响文档嵌入结果；超过保留期的缓存在写入时清理。
+EMBEDDING_CACHE_RETENTION_DAYS = 30
+
+
+def _embedding_cache_key(title: str, text: str) -> bytes:
+    """计算文本块在嵌入缓存中的键。"""
+    return hashlib.sha256(
+        f"{EMBEDDING_MODEL_NAME}\0{title}\0{text}".encode("utf-8")
+    ).digest()
 
 class IncrementalRAGService:
     """
@@ -168,15 +193,20 @@ class IncrementalRAGService:
         return (self.vector_db_service.is_available() and 
                 self.gemini_service.is_available())
     
-    def _get_db_connection(self):
-        """获取数据库连接"""
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个 SQLite 连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(self.db_path)
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            conn = pool.acquire()
         except sqlite3.Error as e:
             log.error(f"连接到世界书数据库失败: {e}", exc_info=True)
-            return None
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
     
     async def process_community_member(self, member_id: str) -> bool:
         """
@@ -194,7 +224,7 @@ class IncrementalRAGService:
         
         # 从数据库获取成员信息
         log.debug(f"尝试处理社区成员档案: {member_id}")
-        member_data = self._get_community_member_data(member_id)
+        member_data = await asyncio.to_thread(self._get_community_member_data, member_id)
         if not member_data:
             log.error(f"无法找到社区成员数据: {member_id}")
             return False
@@ -216,64 +246,164 @@ class IncrementalRAGService:
     
     def _get_community_member_data(self, member_id: str) -> Dict[str, Any]:
         """从数据库获取社区成员数据"""
-        conn = self._get_db_connection()
-        if not conn:
-            return None
+        with self._conn() as conn:
+            if not conn:
+                return None
         
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, title, discord_number_id, content_json FROM community_members WHERE id = ?",
-                (member_id,)
-            )
-            member_row = cursor.fetchone()
-            
-            if member_row:
-                member_dict = dict(member_row)
-                
-                # 解析content_json
-                import json
-                if member_dict.get('content_json'):
-                    member_dict['content'] = json.loads(member_dict['content_json'])
-                    del member_dict['content_json']
-                
-                # 获取关联的昵称
+            try:
+                cursor = conn.cursor()
+                # 用关联子查询一并取出昵称列表，一次查询完成
                 cursor.execute(
-                    "SELECT nickname FROM member_discord_nicknames WHERE member_id = ?",
+                    """
+                    SELECT m.id, m.title, m.discord_number_id, m.content_json,
+                           (SELECT GROUP_CONCAT(n.nickname, char(31))
+                            FROM member_discord_nicknames n WHERE n.member_id = m.id) AS _nicknames
+                    FROM community_members m WHERE m.id = ?
+                    """,
                     (member_id,)
                 )
-                nicknames = [row['nickname'] for row in cursor.fetchall()]
-                member_dict['discord_nickname'] = nicknames
-                log.debug(f"获取社区成员 {member_id} 的昵称: {nicknames}")
+                member_row = cursor.fetchone()
+            
+                if member_row:
+                    member_dict = dict(member_row)
                 
-                return member_dict
+                    # 解析content_json
+                    if member_dict.get('content_json'):
+                        member_dict['content'] = json_utils.loads(member_dict['content_json'])
+                        del member_dict['content_json']
                 
-        except Exception as e:
-            log.error(f"获取社区成员数据时出错: {e}", exc_info=True)
-        finally:
-            if conn:
-                conn.close()
+                    # 拆分关联的昵称
+                    nicknames = member_dict.pop('_nicknames')
+                    nicknames = nicknames.split(NICKNAME_SEPARATOR) if nicknames else []
+                    member_dict['discord_nickname'] = nicknames
+                    log.debug(f"获取社区成员 {member_id} 的昵称: {nicknames}")
+                
+                    return member_dict
+                
+            except Exception as e:
+                log.error(f"获取社区成员数据时出错: {e}", exc_info=True)
         
         return None
     
     def _build_rag_entry_from_member(self, member_data: Dict[str, Any]) -> Dict[str, Any]:
         """将社区成员数据构建为RAG条目格式"""
+        content = member_data.get('content') or {}
         rag_entry = {
             'id': member_data['id'],
             'title': member_data.get('title', member_data['id']),
-            'name': member_data.get('content', {}).get('name', '未命名'),
-            'content': member_data.get('content', {}),
+            'name': content.get('name', '未命名'),
+            'content': content,
             'metadata': {
                 'category': '社区成员',
                 'source': 'community_upload',
-                'uploaded_by': member_data.get('content', {}).get('uploaded_by'),
-                'uploaded_by_name': member_data.get('content', {}).get('uploaded_by_name')
+                'uploaded_by': content.get('uploaded_by'),
+                'uploaded_by_name': content.get('uploaded_by_name')
             },
             'discord_nickname': member_data.get('discord_nickname', [])
         }
         log.debug(f"构建的社区成员 RAG 条目: {rag_entry['id']}")
         return rag_entry
     
+    def _get_cached_embeddings(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """一次查询取出所有已缓存的嵌入向量（float32 数组，直接引用数据库中的字节）；查询失败时视为全部未命中。"""
+        with self._conn() as conn:
+            if not conn:
+                return {}
+            try:
+                placeholders = ",".join("?" * len(keys))
+                rows = conn.execute(
+                    f"SELECT text_sha256, embedding FROM embedding_cache WHERE text_sha256 IN ({placeholders})",
+                    keys
+                ).fetchall()
+                return {
+                    row['text_sha256']: np.frombuffer(row['embedding'], dtype=np.float32)
+                    for row in rows
+                }
+            except sqlite3.Error as e:
+                log.warning(f"读取嵌入缓存失败，将重新生成嵌入: {e}")
+                return {}
+
+    def _put_cached_embeddings(self, embeddings: Dict[bytes, np.ndarray]):
+        """批量写入新生成的嵌入向量，并清理超过保留期的旧缓存。"""
+        if not embeddings:
+            return
+        with self._conn() as conn:
+            if not conn:
+                return
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (text_sha256, embedding) VALUES (?, ?)",
+                    [
+                        (key, embedding.tobytes())
+                        for key, embedding in embeddings.items()
+                    ]
+                )
+                conn.execute(
+                    "DELETE FROM embedding_cache WHERE created_at < datetime('now', ?)",
+                    (f"-{EMBEDDING_CACHE_RETENTION_DAYS} days",)
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                log.warning(f"写入嵌入缓存失败: {e}")
+
+    async def _embed_chunks(self, chunks: List[str], title: str) -> List[Optional[np.ndarray]]:
+        """
+        为各个文本块获取 float32 嵌入向量，返回的列表与 chunks 一一对应，生成失败的块对应 None。
+        先查嵌入缓存，只为未命中的块请求 Gemini，新生成的向量写回缓存。
+        内容相同的块共用同一个缓存键，只请求一次，结果按键回填到所有重复位置。
+        """
+        keys = [_embedding_cache_key(title, chunk) for chunk in chunks]
+        unique_keys = list(dict.fromkeys(keys))
+        embeddings_by_key = await asyncio.to_thread(self._get_cached_embeddings, unique_keys)
+        # 未命中的键 -> 首次出现的块下标
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in embeddings_by_key:
+                missing.setdefault(key, i)
+        log.debug(
+            f"{len(chunks)} 个块中有 {len(unique_keys)} 个不同内容，"
+            f"嵌入缓存命中 {len(unique_keys) - len(missing)} 个"
+        )
+
+        if missing:
+            generated = await self._generate_embeddings([chunks[i] for i in missing.values()], title)
+            new_embeddings = {
+                key: np.asarray(embedding, dtype=np.float32)
+                for key, embedding in zip(missing, generated) if embedding
+            }
+            await asyncio.to_thread(self._put_cached_embeddings, new_embeddings)
+            embeddings_by_key.update(new_embeddings)
+
+        return [embeddings_by_key.get(key) for key in keys]
+
+    async def _generate_embeddings(self, chunks: List[str], title: str) -> List[Optional[List[float]]]:
+        """
+        为各个文本块生成嵌入向量，返回的列表与 chunks 一一对应，生成失败的块对应 None。
+        优先通过一次批量请求完成；批量请求失败时退回逐块并发请求，并发数受 MAX_CONCURRENT_EMBEDS 限制。
+        """
+        embeddings = await self.gemini_service.generate_embeddings_batch(
+            texts=chunks,
+            title=title,
+            task_type="retrieval_document"
+        )
+        # 装饰器在出错时可能返回提示字符串，只接受与块数一致的列表
+        if isinstance(embeddings, list) and len(embeddings) == len(chunks):
+            return embeddings
+        log.warning(f"批量生成嵌入失败，退回逐块生成 ({len(chunks)} 个块)")
+
+        async def embed_one(chunk_content: str) -> Optional[List[float]]:
+            async with _embed_semaphore:
+                # 加入少量随机抖动，避免同一批请求同时打到 Gemini API
+                await asyncio.sleep(random.uniform(0, EMBED_JITTER_SECONDS))
+                return await self.gemini_service.generate_embedding(
+                    text=chunk_content,
+                    title=title,
+                    task_type="retrieval_document"
+                )
+
+        # gather 按传入顺序返回结果，块的顺序保持不变
+        return await asyncio.gather(*(embed_one(chunk) for chunk in chunks))
+
     async def _process_single_entry(self, entry: Dict[str, Any]) -> bool:
         """
         处理单个知识条目，生成嵌入并添加到向量数据库
@@ -290,6 +420,8 @@ class IncrementalRAGService:
         
         try:
             entry_id = entry.get('id', '未知ID')
+            # 提前判断一次，避免在逐块循环中无谓地格式化调试字符串
+            debug_enabled = log.isEnabledFor(logging.DEBUG)
             log.debug(f"开始处理单个条目: {entry_id}")
 
             # 构建文档文本
@@ -299,6 +431,9 @@ class IncrementalRAGService:
                 return False
             
             log.debug(f"为条目 {entry_id} 构建文档文本成功，长度: {len(document_text)}")
+            if len(document_text.strip()) < MIN_DOC_CHARS:
+                log.debug(f"条目 {entry_id} 的文档文本不足 {MIN_DOC_CHARS} 个字符，跳过嵌入")
+                return False
             
             # 文本分块
             chunks = create_text_chunks(document_text, max_chars=1000)
@@ -307,43 +442,55 @@ class IncrementalRAGService:
                 return False
             
             log.debug(f"条目 {entry_id} 被分割成 {len(chunks)} 个块")
+            # 跳过过短的块，保留原始下标用作块 ID
+            indexed_chunks = [
+                (chunk_index, chunk) for chunk_index, chunk in enumerate(chunks)
+                if len(chunk) >= MIN_CHUNK_CHARS
+            ]
+            if len(indexed_chunks) < len(chunks):
+                log.debug(f"条目 {entry_id} 有 {len(chunks) - len(indexed_chunks)} 个块不足 {MIN_CHUNK_CHARS} 个字符，已跳过")
             
-            # 为每个块生成嵌入并添加到向量数据库
-            ids_to_add = []
-            documents_to_add = []
-            embeddings_to_add = []
-            metadatas_to_add = []
-            
-            for chunk_index, chunk_content in enumerate(chunks):
-                chunk_id = f"{entry_id}:{chunk_index}"
-                log.debug(f"正在为块 {chunk_id} 生成嵌入向量...")
+            # 按批为块生成嵌入并添加到向量数据库，每批完成后立即写入并释放，限制单个条目的内存峰值
+            title = entry.get('title', entry_id)
+            # 所有块共用同一个元数据字典
+            metadata = entry.get('metadata', {})
+            total_added = 0
+            for batch_start in range(0, len(indexed_chunks), ADD_DOCUMENTS_BATCH_SIZE):
+                batch = indexed_chunks[batch_start:batch_start + ADD_DOCUMENTS_BATCH_SIZE]
+                ids_to_add = []
+                documents_to_add = []
+                embeddings_to_add = []
+                metadatas_to_add = []
                 
-                # 生成嵌入向量
-                embedding = await self.gemini_service.generate_embedding(
-                    text=chunk_content,
-                    title=entry.get('title', entry_id),
-                    task_type="retrieval_document"
-                )
+                log.debug(f"正在为条目 {entry_id} 的 {len(batch)} 个块生成嵌入向量...")
+                embeddings = await self._embed_chunks([chunk for _, chunk in batch], title)
+                
+                for (chunk_index, chunk_content), embedding in zip(batch, embeddings):
+                    chunk_id = f"{entry_id}:{chunk_index}"
+                    if embedding is not None:
+                        ids_to_add.append(chunk_id)
+                        documents_to_add.append(chunk_content)
+                        embeddings_to_add.append(embedding)
+                        metadatas_to_add.append(metadata)
+                        if debug_enabled:
+                            log.debug(f"成功为块 {chunk_id} 生成嵌入向量")
+                    else:
+                        log.error(f"无法为块 {chunk_id} 生成嵌入向量")
                 
-                if embedding:
-                    ids_to_add.append(chunk_id)
-                    documents_to_add.append(chunk_content)
-                    embeddings_to_add.append(embedding)
-                    metadatas_to_add.append(entry.get('metadata', {}))
-                    log.debug(f"成功为块 {chunk_id} 生成嵌入向量")
-                else:
-                    log.error(f"无法为块 {chunk_id} 生成嵌入向量")
+                if ids_to_add:
+                    log.debug(f"尝试将 {len(ids_to_add)} 个文档块添加到向量数据库...")
+                    await asyncio.to_thread(
+                        self.vector_db_service.add_documents,
+                        ids=ids_to_add,
+                        documents=documents_to_add,
+                        # 以连续的 float32 矩阵传入，避免逐个 Python float 的转换与复制
+                        embeddings=np.asarray(embeddings_to_add, dtype=np.float32),
+                        metadatas=metadatas_to_add
+                    )
+                    total_added += len(ids_to_add)
             
-            # 批量添加到向量数据库
-            if ids_to_add:
-                log.debug(f"尝试将 {len(ids_to_add)} 个文档块添加到向量数据库...")
-                self.vector_db_service.add_documents(
-                    ids=ids_to_add,
-                    documents=documents_to_add,
-                    embeddings=embeddings_to_add,
-                    metadatas=metadatas_to_add
-                )
-                log.info(f"成功将 {len(ids_to_add)} 个文档块添加到向量数据库，条目 {entry_id} 处理完成。")
+            if total_added:
+                log.info(f"成功将 {total_added} 个文档块添加到向量数据库，条目 {entry_id} 处理完成。")
                 return True
             else:
                 log.warning(f"没有成功生成任何嵌入向量，条目 {entry_id} 未添加到向量数据库")
@@ -369,7 +516,7 @@ class IncrementalRAGService:
         
         log.debug(f"尝试处理通用知识条目: {entry_id}")
         # 从数据库获取通用知识条目
-        entry_data = self._get_general_knowledge_data(entry_id)
+        entry_data = await asyncio.to_thread(self._get_general_knowledge_data, entry_id)
         if not entry_data:
             log.error(f"无法找到通用知识条目: {entry_id}")
             return False
@@ -391,31 +538,28 @@ class IncrementalRAGService:
     
     def _get_general_knowledge_data(self, entry_id: str) -> Dict[str, Any]:
         """从数据库获取通用知识条目数据"""
-        conn = self._get_db_connection()
-        if not conn:
-            return None
+        with self._conn() as conn:
+            if not conn:
+                return None
         
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT gk.id, gk.title, gk.name, gk.content_json, c.name as category_name "
-                "FROM general_knowledge gk "
-                "LEFT JOIN categories c ON gk.category_id = c.id "
-                "WHERE gk.id = ?",
-                (entry_id,)
-            )
-            entry_row = cursor.fetchone()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT gk.id, gk.title, gk.name, gk.content_json, c.name as category_name "
+                    "FROM general_knowledge gk "
+                    "LEFT JOIN categories c ON gk.category_id = c.id "
+                    "WHERE gk.id = ?",
+                    (entry_id,)
+                )
+                entry_row = cursor.fetchone()
             
-            if entry_row:
-                entry_dict = dict(entry_row)
-                log.debug(f"从数据库获取通用知识条目 {entry_id} 成功。")
-                return entry_dict
+                if entry_row:
+                    entry_dict = dict(entry_row)
+                    log.debug(f"从数据库获取通用知识条目 {entry_id} 成功。")
+                    return entry_dict
                 
-        except Exception as e:
-            log.error(f"获取通用知识条目数据时出错: {e}", exc_info=True)
-        finally:
-            if conn:
-                conn.close()
+            except Exception as e:
+                log.error(f"获取通用知识条目数据时出错: {e}", exc_info=True)
         
         return None
     
@@ -425,8 +569,7 @@ class IncrementalRAGService:
         content_text = ''
         if entry_data.get('content_json'):
             try:
-                import json
-                content_dict = json.loads(entry_data['content_json'])
+                content_dict = json_utils.loads(entry_data['content_json'])
                 content_text = content_dict.get('description', '')
             except (json.JSONDecodeError, TypeError):
                 content_text = entry_data.get('content_json', '')
@@ -476,6 +619,8 @@ class IncrementalRAGService:
             # 我们只需要 id 字段来执行删除
             # 备用策略：获取集合中的所有ID，然后在本地进行过滤。
             # 这在集合很大时效率很低。
+            # 注意：此处保持同步调用，不放入线程。调用方会紧接着创建 delete_entry 与 process_* 两个任务，
+            # 删除必须在重新写入之前完成，否则可能误删刚写入的新向量。
             all_ids = self.vector_db_service.get_all_ids()
             # 检查原始 ID 和带 'db_' 前缀的 ID
             prefixed_id = f"db_{str_entry_id}"
@@ -487,7 +632,8 @@ class IncrementalRAGService:
                 log.warning(f"在向量数据库中没有找到与条目 {entry_id} 相关的文档块可供删除。")
                 return True # 认为操作成功，因为目标状态（不存在）已达成
 
-            log.debug(f"找到 {len(ids_to_delete)} 个与条目 {entry_id} 相关的文档块，准备删除: {ids_to_delete}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f"找到 {len(ids_to_delete)} 个与条目 {entry_id} 相关的文档块，准备删除: {ids_to_delete}")
             
             self.vector_db_service.delete_documents(ids=ids_to_delete)
             
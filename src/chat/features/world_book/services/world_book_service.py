@@ -2,14 +2,21 @@ import logging
 from typing import Optional, List, Dict, Any
 import asyncio
 import sqlite3
-import json
 import os
+import re
+import time
 import discord
+import numpy as np
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
  # 导入新的服务依赖
 from src.chat.services.gemini_service import GeminiService, gemini_service
 from src.chat.services.vector_db_service import VectorDBService, vector_db_service
+from src.chat.features.world_book.database.world_book_db_manager import world_book_db_manager, NICKNAME_SEPARATOR
+from src.chat.utils.sqlite_pool import get_pool
+from src.chat.utils import json_utils
 from src import config
  
 log = logging.getLogger(__name__)
@@ -17,6 +24,204 @@ log = logging.getLogger(__name__)
 # 定义数据库文件路径
 DB_PATH = os.path.join(config.DATA_DIR, 'world_book.sqlite3')
 
+# 生成条目 ID 时，标题中需要替换为下划线的字符（只保留字母、数字、中文和下划线）
+_ENTRY_ID_UNSAFE_CHARS = re.compile(r'[^\w\u4e00-\u9fff]')
+
+# 添加通用知识时使用的 SQL。保持为固定字符串，sqlite3 会在每个连接上缓存其预编译语句
+# 类别“查找或创建”合并为一条 UPSERT 语句（需要 SQLite >= 3.35），冲突时也会返回已有 ID
+_UPSERT_CATEGORY_SQL = """
+    INSERT INTO categories (name) VALUES (?)
+    ON CONFLICT(name) DO UPDATE SET name = name
+    RETURNING id
+"""
+_INSERT_GENERAL_KNOWLEDGE_SQL = """
+    INSERT INTO general_knowledge (id, title, name, content_json, category_id, contributor_id, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+"""
+
+# 用户档案缓存：按 Discord ID 缓存查询结果（包括“没有档案”），档案写入时主动失效
+PROFILE_CACHE_TTL_SECONDS = 300
+PROFILE_CACHE_MAXSIZE = 1024
+
+# 语义缓存：随机投影 LSH 的哈希表数量、每张表的哈希位数
+SEMANTIC_CACHE_NUM_TABLES = 4
+SEMANTIC_CACHE_HASH_BITS = 12
+# 命中所需的最低余弦相似度、条目有效期（秒）与最大条目数
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_TTL_SECONDS = 600
+SEMANTIC_CACHE_MAXSIZE = 10000
+# 向量搜索时实际召回的数量（超集），命中时再按调用方的 n_results 与 max_distance 截取
+SEMANTIC_CACHE_TOP_K = 20
+
+# 近邻复用：保存最近若干次向量搜索的候选集，新查询与其中之一的余弦相似度达到阈值时，
+# 直接在该候选集内重新计算距离，跳过完整的向量库搜索
+RECENT_SEARCH_MAXLEN = 32
+RECENT_SEARCH_THRESHOLD = 0.85
+
+
+class SemanticCache:
+    """
+    基于随机投影 LSH 的 RAG 查询语义缓存。
+    查询向量在每张哈希表中落入一个桶，命中任一桶的已缓存向量作为候选，
+    再以余弦相似度复核，超过阈值即复用其搜索结果。条目按 TTL 过期，超出容量时先进先出淘汰。
+    """
+
+    def __init__(
+        self,
+        num_tables: int = SEMANTIC_CACHE_NUM_TABLES,
+        hash_bits: int = SEMANTIC_CACHE_HASH_BITS,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: float = SEMANTIC_CACHE_TTL_SECONDS,
+        maxsize: int = SEMANTIC_CACHE_MAXSIZE,
+        seed: int = 0,
+    ):
+        self.num_tables = num_tables
+        self.hash_bits = hash_bits
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._rng = np.random.default_rng(seed)
+        self._planes: Optional[np.ndarray] = None  # 形状 (num_tables, hash_bits, dim)，首次使用时按向量维度生成
+        self._bit_weights = 1 << np.arange(hash_bits, dtype=np.int64)
+        self._tables: List[Dict[int, set]] = [{} for _ in range(num_tables)]
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # entry_id -> (expires_at, 单位向量, 桶键, 结果)
+        self._next_id = 0
+
+    def _prepare(self, embedding: List[float]) -> Optional[tuple]:
+        """将向量归一化并计算其在每张表中的桶键；维度与已有投影不一致时返回 None。"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        if self._planes is None:
+            self._planes = self._rng.standard_normal(
+                (self.num_tables, self.hash_bits, vector.shape[0])
+            ).astype(np.float32)
+        elif self._planes.shape[2] != vector.shape[0]:
+            return None
+        vector /= norm
+        bits = (self._planes @ vector) > 0
+        bucket_keys = tuple(int(key) for key in bits.astype(np.int64) @ self._bit_weights)
+        return vector, bucket_keys
+
+    def _remove(self, entry_id: int):
+        _, _, bucket_keys, _ = self._entries.pop(entry_id)
+        for table, key in zip(self._tables, bucket_keys):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def get(self, embedding: List[float]) -> Optional[List[Dict[str, Any]]]:
+        """查找与给定查询向量足够相似的已缓存查询，返回其搜索结果；未命中返回 None。"""
+        prepared = self._prepare(embedding)
+        if prepared is None:
+            return None
+        vector, bucket_keys = prepared
+
+        candidates = set()
+        for table, key in zip(self._tables, bucket_keys):
+            candidates.update(table.get(key, ()))
+
+        now = time.monotonic()
+        best_results, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            expires_at, cached_vector, _, results = self._entries[entry_id]
+            if expires_at <= now:
+                self._remove(entry_id)
+                continue
+            similarity = float(cached_vector @ vector)
+            if similarity >= best_similarity:
+                best_results, best_similarity = results, similarity
+        return best_results
+
+    def put(self, embedding: List[float], results: List[Dict[str, Any]]):
+        """缓存一次查询的搜索结果。"""
+        prepared = self._prepare(embedding)
+        if prepared is None:
+            return
+        vector, bucket_keys = prepared
+
+        while len(self._entries) >= self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (time.monotonic() + self.ttl, vector, bucket_keys, results)
+        for table, key in zip(self._tables, bucket_keys):
+            table.setdefault(key, set()).add(entry_id)
+
+    def clear(self):
+        """清空缓存，在世界书向量库内容变化时调用。"""
+        for table in self._tables:
+            table.clear()
+        self._entries.clear()
+
+
+class RecentSearchCache:
+    """
+    保存最近若干次向量搜索的查询向量、召回的候选条目及条目向量。
+    同一时段内的帖子话题往往相近：新查询与某次最近查询足够相似时，
+    其真正的近邻大概率仍在那次召回的候选集内，只需对这些条目重新计算距离。
+    """
+
+    def __init__(
+        self,
+        maxlen: int = RECENT_SEARCH_MAXLEN,
+        threshold: float = RECENT_SEARCH_THRESHOLD,
+    ):
+        self.threshold = threshold
+        # 元素为 (查询单位向量, 候选结果列表, 候选条目向量矩阵)
+        self._searches: deque = deque(maxlen=maxlen)
+
+    def put(self, embedding: List[float], results: List[Dict[str, Any]], result_embeddings: List[List[float]]):
+        """记录一次完整向量搜索的候选集。"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        matrix = np.asarray(result_embeddings, dtype=np.float32)
+        if not results or norm == 0 or matrix.shape != (len(results), vector.shape[0]):
+            return
+        self._searches.append((vector / norm, results, matrix))
+
+    def rerank(self, embedding: List[float], n_results: int, max_distance: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        找到与给定查询最相似的最近搜索，若相似度达到阈值，则按与向量库一致的平方 L2 距离
+        对其候选集重新排序，返回距离不超过 max_distance 的前 n_results 个结果。
+        候选集只是近似：没有相似的最近搜索、或满足距离阈值的结果不足 n_results 个
+        （真正的近邻可能不在其中）时返回 None，由调用方执行完整的向量搜索。
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        unit = vector / norm
+
+        best, best_similarity = None, self.threshold
+        for search in self._searches:
+            cached_unit, _, matrix = search
+            if cached_unit.shape != unit.shape:
+                continue
+            similarity = float(cached_unit @ unit)
+            if similarity >= best_similarity:
+                best, best_similarity = search, similarity
+        if best is None:
+            return None
+
+        _, results, matrix = best
+        distances = ((matrix - vector) ** 2).sum(axis=1)
+        reranked = [
+            {**results[i], "distance": float(distances[i])}
+            for i in np.argsort(distances, kind="stable")
+            if distances[i] <= max_distance
+        ][:n_results]
+        return reranked if len(reranked) >= n_results else None
+
+    def clear(self):
+        """清空记录，在世界书向量库内容变化时调用。"""
+        self._searches.clear()
+
+
 class WorldBookService:
     """
     使用向量数据库进行语义搜索，以查找相关的世界书条目。
@@ -25,17 +230,27 @@ class WorldBookService:
     def __init__(self, gemini_svc: GeminiService, vector_db_svc: VectorDBService):
         self.gemini_service = gemini_svc
         self.vector_db_service = vector_db_svc
+        self.semantic_cache = SemanticCache()
+        self.recent_searches = RecentSearchCache()
+        self._semantic_cache_version = vector_db_svc.version
+        # discord_id -> (过期时间, 档案字典或 None)
+        self._profile_cache: "OrderedDict[str, tuple]" = OrderedDict()
         log.info("WorldBookService (RAG + SQLite version) 初始化完成。")
 
-    def _get_db_connection(self):
-        """建立并返回一个新的 SQLite 数据库连接。"""
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个 SQLite 连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(DB_PATH)
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-            return conn
+            conn = pool.acquire()
         except sqlite3.Error as e:
             log.error(f"连接到世界书数据库 '{DB_PATH}' 失败: {e}", exc_info=True)
-            return None
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
 
     def get_profile_by_discord_id(self, discord_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -49,47 +264,74 @@ class WorldBookService:
         """
         if not discord_id:
             return None
+
+        discord_id = str(discord_id)
+        cached = self._profile_cache.get(discord_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._profile_cache.move_to_end(discord_id)
+            return cached[1]
         
-        conn = self._get_db_connection()
-        if not conn:
-            return None
+        with self._conn() as conn:
+            if not conn:
+                return None
         
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT * FROM community_members WHERE discord_number_id = ?",
-                (str(discord_id),)
-            )
-            member_row = cursor.fetchone()
-
-            if not member_row:
+            try:
+                cursor = conn.cursor()
+                # 用关联子查询一并取出昵称列表，一次查询完成
+                cursor.execute(
+                    """
+                    SELECT m.*,
+                           (SELECT GROUP_CONCAT(n.nickname, char(31))
+                            FROM member_discord_nicknames n WHERE n.member_id = m.id) AS _nicknames
+                    FROM community_members m WHERE m.discord_number_id = ? LIMIT 1
+                    """,
+                    (discord_id,)
+                )
+                member_row = cursor.fetchone()
+
+                if not member_row:
+                    self._cache_profile(discord_id, None)
+                    return None
+
+                member_dict = dict(member_row)
+                debug_enabled = log.isEnabledFor(logging.DEBUG)
+                if debug_enabled:
+                    log.debug(f"成功通过 Discord ID '{discord_id}' 找到了社区成员 '{member_dict.get('id')}' 的档案。")
+                    log.debug(f"数据库原始数据 (member_row): {member_row}")
+
+                # 拆分关联的昵称
+                nicknames = member_dict.pop('_nicknames')
+                member_dict['discord_nickname'] = nicknames.split(NICKNAME_SEPARATOR) if nicknames else []
+
+                # 解析 content_json
+                if member_dict.get('content_json'):
+                    member_dict['content'] = json_utils.loads(member_dict['content_json'])
+                    del member_dict['content_json']
+
+                if debug_enabled:
+                    log.debug(f"解析后的用户档案 (member_dict): {member_dict}")
+                self._cache_profile(discord_id, member_dict)
+                return member_dict
+            except sqlite3.Error as e:
+                log.error(f"通过 Discord ID '{discord_id}' 查找档案时发生数据库错误: {e}", exc_info=True)
                 return None
 
-            member_dict = dict(member_row)
-            log.debug(f"成功通过 Discord ID '{discord_id}' 找到了社区成员 '{member_dict.get('id')}' 的档案。")
-            log.debug(f"数据库原始数据 (member_row): {member_row}")
-
-            # 获取关联的昵称
-            cursor.execute(
-                "SELECT nickname FROM member_discord_nicknames WHERE member_id = ?",
-                (member_dict['id'],)
-            )
-            nicknames = [row['nickname'] for row in cursor.fetchall()]
-            member_dict['discord_nickname'] = nicknames
-
-            # 解析 content_json
-            if member_dict.get('content_json'):
-                member_dict['content'] = json.loads(member_dict['content_json'])
-                del member_dict['content_json']
+    def _cache_profile(self, discord_id: str, profile: Optional[Dict[str, Any]]):
+        """写入档案缓存，超出容量时淘汰最久未使用的条目。"""
+        self._profile_cache[discord_id] = (time.monotonic() + PROFILE_CACHE_TTL_SECONDS, profile)
+        self._profile_cache.move_to_end(discord_id)
+        while len(self._profile_cache) > PROFILE_CACHE_MAXSIZE:
+            self._profile_cache.popitem(last=False)
 
-            log.debug(f"解析后的用户档案 (member_dict): {member_dict}")
-            return member_dict
-        except sqlite3.Error as e:
-            log.error(f"通过 Discord ID '{discord_id}' 查找档案时发生数据库错误: {e}", exc_info=True)
-            return None
-        finally:
-            if conn:
-                conn.close()
+    def invalidate_profile_cache(self, discord_id: Optional[str] = None):
+        """
+        使档案缓存失效。传入 discord_id 时只移除该用户的缓存，否则清空全部。
+        在任何写入 community_members / member_discord_nicknames 的地方提交后调用。
+        """
+        if discord_id is None:
+            self._profile_cache.clear()
+        else:
+            self._profile_cache.pop(str(discord_id), None)
 
     def is_ready(self) -> bool:
         """检查服务是否已准备好（所有依赖项都可用）。"""
@@ -128,11 +370,12 @@ class WorldBookService:
 
         # 2. 使用 GeminiService 总结对话历史以生成查询
         # 在将历史记录传递给RAG总结器之前，移除最后一条由系统注入的上下文提示
-        history_for_rag = conversation_history.copy() if conversation_history else []
+        # 只读不改，无需复制整个历史；需要移除时用切片得到新列表
+        history_for_rag = conversation_history or []
         if history_for_rag and history_for_rag[-1].get("role") == "model":
             # 通过一个独特的标记来识别这条系统消息
             if "我会按好感度和上下文综合回复" in history_for_rag[-1].get("parts", [""])[0]:
-                history_for_rag.pop()
+                history_for_rag = history_for_rag[:-1]
                 log.debug("已为RAG总结移除系统注入的上下文提示。")
 
         # --- RAG 查询总结 ---
@@ -187,19 +430,45 @@ class WorldBookService:
             log.error("无法为 RAG 查询生成嵌入。")
             return []
 
-        # 4. 执行向量搜索
+        # 4. 执行向量搜索：先查语义缓存，再尝试在相似的最近搜索的候选集内重新打分，
+        #    都未命中时召回 TOP_K 个结果的超集；只有完整搜索的结果才写入缓存
         try:
-            search_results = self.vector_db_service.search(
-                query_embedding=query_embedding,
-                n_results=n_results,
-                max_distance=max_distance
-            )
-            
-            if search_results:
-                search_brief = [f"{r['id']}({r['distance']:.4f})" for r in search_results]
-                log.debug(f"RAG 搜索简报 (ID 和 距离): {search_brief}")
+            # 向量库内容变化后，旧的缓存结果不再可信
+            if self._semantic_cache_version != self.vector_db_service.version:
+                self.semantic_cache.clear()
+                self.recent_searches.clear()
+                self._semantic_cache_version = self.vector_db_service.version
+            search_results = None
+            candidates = self.semantic_cache.get(query_embedding)
+            if candidates is not None:
+                log.debug("RAG 查询命中语义缓存，跳过向量搜索。")
             else:
-                log.debug("RAG 搜索未返回任何结果。")
+                search_results = self.recent_searches.rerank(query_embedding, n_results, max_distance)
+                if search_results is not None:
+                    # 近似结果不写入语义缓存，避免在缓存有效期内反复返回
+                    log.debug("RAG 查询与最近的搜索相似，在其候选集内重新打分，跳过向量搜索。")
+                else:
+                    candidates = self.vector_db_service.search(
+                        query_embedding=query_embedding,
+                        n_results=max(n_results, SEMANTIC_CACHE_TOP_K),
+                        max_distance=float("inf"),
+                        include_embeddings=True
+                    )
+                    candidate_embeddings = [r.pop("embedding") for r in candidates]
+                    self.recent_searches.put(query_embedding, candidates, candidate_embeddings)
+                    # 空结果可能来自搜索出错，不予缓存
+                    if candidates:
+                        self.semantic_cache.put(query_embedding, candidates)
+            if search_results is None:
+                search_results = [r for r in candidates if r['distance'] <= max_distance][:n_results]
+            
+            # 每条消息都会走到这里，只在 DEBUG 级别下才格式化搜索简报
+            if log.isEnabledFor(logging.DEBUG):
+                if search_results:
+                    search_brief = [f"{r['id']}({r['distance']:.4f})" for r in search_results]
+                    log.debug(f"RAG 搜索简报 (ID 和 距离): {search_brief}")
+                else:
+                    log.debug("RAG 搜索未返回任何结果。")
 
             return search_results
         except Exception as e:
@@ -207,63 +476,65 @@ class WorldBookService:
             return []
 
     async def _create_pending_entry(self, interaction: discord.Interaction, entry_type: str, entry_data: Dict[str, Any], review_settings: Dict[str, Any]) -> Optional[int]:
-        """将提交的数据作为待审核条目存入数据库"""
-        conn = self._get_db_connection()
-        if not conn:
-            return None
+        """将提交的数据作为待审核条目存入数据库（在线程中执行，不阻塞事件循环）"""
+        return await asyncio.to_thread(self._insert_pending_entry, interaction, entry_type, entry_data, review_settings)
+
+    def _insert_pending_entry(self, interaction: discord.Interaction, entry_type: str, entry_data: Dict[str, Any], review_settings: Dict[str, Any]) -> Optional[int]:
+        """_create_pending_entry 的同步实现"""
+        with self._conn() as conn:
+            if not conn:
+                return None
             
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
             
-            duration_minutes = review_settings['review_duration_minutes']
-            expires_at = datetime.utcnow() + timedelta(minutes=duration_minutes)
+                duration_minutes = review_settings['review_duration_minutes']
+                expires_at = datetime.utcnow() + timedelta(minutes=duration_minutes)
             
-            data_json = json.dumps(entry_data, ensure_ascii=False)
+                data_json = json_utils.dumps(entry_data)
             
-            cursor.execute("""
-                INSERT INTO pending_entries
-                (entry_type, data_json, channel_id, guild_id, proposer_id, expires_at, message_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                entry_type,
-                data_json,
-                interaction.channel_id,
-                interaction.guild_id,
-                interaction.user.id,
-                expires_at.isoformat(),
-                -1 # 临时 message_id
-            ))
+                cursor.execute("""
+                    INSERT INTO pending_entries
+                    (entry_type, data_json, channel_id, guild_id, proposer_id, expires_at, message_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    entry_type,
+                    data_json,
+                    interaction.channel_id,
+                    interaction.guild_id,
+                    interaction.user.id,
+                    expires_at.isoformat(),
+                    -1 # 临时 message_id
+                ))
             
-            pending_id = cursor.lastrowid
-            conn.commit()
-            log.info(f"已创建待审核条目 #{pending_id} (类型: {entry_type})，提交者: {interaction.user.id}")
-            return pending_id
+                pending_id = cursor.lastrowid
+                conn.commit()
+                log.info(f"已创建待审核条目 #{pending_id} (类型: {entry_type})，提交者: {interaction.user.id}")
+                return pending_id
             
-        except sqlite3.Error as e:
-            log.error(f"创建待审核条目时发生数据库错误: {e}", exc_info=True)
-            conn.rollback()
-            return None
-        finally:
-            if conn:
-                conn.close()
+            except sqlite3.Error as e:
+                log.error(f"创建待审核条目时发生数据库错误: {e}", exc_info=True)
+                conn.rollback()
+                return None
 
     async def _update_message_id_for_pending_entry(self, pending_id: int, message_id: int):
-        """更新待审核条目的 message_id"""
-        conn = self._get_db_connection()
-        if not conn:
-            return
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE pending_entries SET message_id = ? WHERE id = ?", (message_id, pending_id))
-            conn.commit()
-            log.info(f"已为待审核条目 #{pending_id} 更新 message_id 为 {message_id}")
-        except sqlite3.Error as e:
-            log.error(f"更新待审核条目的 message_id 时出错: {e}", exc_info=True)
-            conn.rollback()
-        finally:
-            if conn:
-                conn.close()
+        """更新待审核条目的 message_id（在线程中执行，不阻塞事件循环）"""
+        await asyncio.to_thread(self._set_pending_entry_message_id, pending_id, message_id)
+
+    def _set_pending_entry_message_id(self, pending_id: int, message_id: int):
+        """_update_message_id_for_pending_entry 的同步实现"""
+        with self._conn() as conn:
+            if not conn:
+                return
+
+            try:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE pending_entries SET message_id = ? WHERE id = ?", (message_id, pending_id))
+                conn.commit()
+                log.info(f"已为待审核条目 #{pending_id} 更新 message_id 为 {message_id}")
+            except sqlite3.Error as e:
+                log.error(f"更新待审核条目的 message_id 时出错: {e}", exc_info=True)
+                conn.rollback()
 
     async def initiate_review_process(
         self,
@@ -354,7 +625,7 @@ class WorldBookService:
         
         log.info(f"已成功为待审核条目 #{pending_id} 发起公开审核。")
 
-    def add_general_knowledge(self, title: str, name: str, content_text: str, category_name: str, contributor_id: int = None) -> bool:
+    def add_general_knowledge(self, title: str, name: str, content_text: str, category_name: str, contributor_id: int = None) -> Optional[str]:
         """
         向 general_knowledge 表添加一个新的知识条目。
         
@@ -366,69 +637,56 @@ class WorldBookService:
             contributor_id: 贡献者的 Discord ID (可选)
             
         Returns:
-            bool: 添加成功返回 True，否则返回 False
+            Optional[str]: 添加成功返回新条目的 ID，否则返回 None
         """
         log.info(f"尝试添加通用知识条目: title='{title}', name='{name}', category='{category_name}'")
-        conn = self._get_db_connection()
-        if not conn:
-            log.error("数据库连接不可用，无法添加知识条目。")
-            return False
-            
-        try:
-            cursor = conn.cursor()
-            
-            # 1. 检查或创建类别
-            cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-            category_row = cursor.fetchone()
-            
-            if category_row:
-                category_id = category_row[0]
-                log.debug(f"类别 '{category_name}' 已存在，ID: {category_id}")
-            else:
-                # 如果类别不存在，则创建新类别
-                cursor.execute("INSERT INTO categories (name) VALUES (?)", (category_name,))
-                category_id = cursor.lastrowid
-                log.info(f"创建了新类别: {category_name} (ID: {category_id})")
-            
-            # 2. 准备内容数据
-            # 根据 build_vector_index.py 中的处理方式，我们需要将内容组织成字典格式
-            # 这里我们简单地将文本内容作为 "description" 字段
-            content_dict = {"description": content_text}
-            content_json = json.dumps(content_dict, ensure_ascii=False)
-            log.debug(f"知识条目内容 JSON: {content_json}")
-            
-            # 3. 生成唯一的条目 ID
-            # 使用标题和时间戳生成一个唯一ID
-            import time
-            import re
-            # 清理标题，只保留字母、数字、中文和下划线，用作ID的一部分
-            clean_title = re.sub(r'[^\w\u4e00-\u9fff]', '_', title)[:50]  # 限制长度
-            entry_id = f"{clean_title}_{int(time.time())}"
-            log.debug(f"生成的知识条目 ID: {entry_id}")
-            
-            # 4. 插入新条目
-            cursor.execute("""
-                INSERT INTO general_knowledge (id, title, name, content_json, category_id, contributor_id, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
-            """, (entry_id, title, name, content_json, category_id, contributor_id))
+        with self._conn() as conn:
+            if not conn:
+                log.error("数据库连接不可用，无法添加知识条目。")
+                return None
             
-            conn.commit()
-            log.info(f"成功添加知识条目: {entry_id} ({title}) 到类别 {category_name}")
-            return True
+            try:
+                cursor = conn.cursor()
+                # 1. 查找或创建类别（一条 UPSERT 语句）
+                cursor.execute(_UPSERT_CATEGORY_SQL, (category_name,))
+                category_id = cursor.fetchone()[0]
+                log.debug(f"类别 '{category_name}' 的 ID: {category_id}")
+                
+                # 2. 准备内容数据
+                # 根据 build_vector_index.py 中的处理方式，我们需要将内容组织成字典格式
+                # 这里我们简单地将文本内容作为 "description" 字段
+                content_dict = {"description": content_text}
+                content_json = json_utils.dumps(content_dict)
+                log.debug(f"知识条目内容 JSON: {content_json}")
+                
+                # 3. 生成唯一的条目 ID
+                # 使用标题和时间戳生成一个唯一ID
+                # 清理标题，只保留字母、数字、中文和下划线，用作ID的一部分
+                clean_title = _ENTRY_ID_UNSAFE_CHARS.sub('_', title)[:50]  # 限制长度
+                entry_id = f"{clean_title}_{int(time.time())}"
+                log.debug(f"生成的知识条目 ID: {entry_id}")
+                
+                # 4. 插入新条目
+                cursor.execute(
+                    _INSERT_GENERAL_KNOWLEDGE_SQL,
+                    (entry_id, title, name, content_json, category_id, contributor_id)
+                )
+                
+                conn.commit()
+                world_book_db_manager.invalidate_cache()
+                log.info(f"成功添加知识条目: {entry_id} ({title}) 到类别 {category_name}")
+                return entry_id
             
-        except sqlite3.Error as e:
-            log.error(f"添加知识条目时发生数据库错误: {e}", exc_info=True)
-            if conn:
-                conn.rollback()
-            return False
-        except Exception as e:
-            log.error(f"添加知识条目时发生未知错误: {e}", exc_info=True)
-            if conn:
-                conn.rollback()
-            return False
-        finally:
-            if conn:
-                conn.close()
+            except sqlite3.Error as e:
+                log.error(f"添加知识条目时发生数据库错误: {e}", exc_info=True)
+                if conn:
+                    conn.rollback()
+                return None
+            except Exception as e:
+                log.error(f"添加知识条目时发生未知错误: {e}", exc_info=True)
+                if conn:
+                    conn.rollback()
+                return None
 
 # 使用已导入的全局服务实例来创建 WorldBookService 的单例
 world_book_service = WorldBookService(gemini_service, vector_db_service)
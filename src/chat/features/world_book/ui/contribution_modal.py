@@ -1,16 +1,18 @@
 import discord
 import logging
-import json
 import sqlite3
 import os
+from contextlib import contextmanager
 from typing import Dict, Any
 from datetime import datetime, timedelta
 
 from src import config
 from src.chat.config import chat_config
 from src.chat.features.world_book.services.incremental_rag_service import incremental_rag_service
+from src.chat.features.world_book.services.world_book_service import world_book_service
+from src.chat.utils.sqlite_pool import get_pool
+from src.chat.utils import json_utils
 import asyncio
-import re
 
 log = logging.getLogger(__name__)
 
@@ -60,73 +62,81 @@ class WorldBookContributionModal(discord.ui.Modal, title="贡献知识"):
         )
         self.add_item(self.content_input)
 
-    def _get_world_book_connection(self):
-        """获取世界书数据库的连接"""
+    @contextmanager
+    def _conn(self):
+        """从连接池借出一个世界书数据库连接，退出 with 块时自动归还；连接失败时产出 None。"""
+        pool = get_pool(os.path.join(config.DATA_DIR, 'world_book.sqlite3'))
         try:
-            db_path = os.path.join(config.DATA_DIR, 'world_book.sqlite3')
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            conn = pool.acquire()
         except sqlite3.Error as e:
             log.error(f"连接到世界书数据库失败: {e}", exc_info=True)
-            return None
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
 
     async def create_pending_entry(self, interaction: discord.Interaction, knowledge_data: Dict[str, Any]) -> int | None:
-        """将提交的数据作为待审核条目存入数据库"""
-        conn = self._get_world_book_connection()
-        if not conn:
-            return None
+        """将提交的数据作为待审核条目存入数据库（在线程中执行，不阻塞事件循环）"""
+        return await asyncio.to_thread(self._insert_pending_entry, interaction, knowledge_data)
+
+    def _insert_pending_entry(self, interaction: discord.Interaction, knowledge_data: Dict[str, Any]) -> int | None:
+        """create_pending_entry 的同步实现"""
+        with self._conn() as conn:
+            if not conn:
+                return None
             
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
             
-            duration_minutes = chat_config.WORLD_BOOK_CONFIG['review_settings']['review_duration_minutes']
-            expires_at = datetime.utcnow() + timedelta(minutes=duration_minutes)
+                duration_minutes = chat_config.WORLD_BOOK_CONFIG['review_settings']['review_duration_minutes']
+                expires_at = datetime.utcnow() + timedelta(minutes=duration_minutes)
             
-            data_json = json.dumps(knowledge_data, ensure_ascii=False)
+                data_json = json_utils.dumps(knowledge_data)
             
-            cursor.execute("""
-                INSERT INTO pending_entries
-                (entry_type, data_json, channel_id, guild_id, proposer_id, expires_at, message_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                'general_knowledge',
-                data_json,
-                interaction.channel_id,
-                interaction.guild_id,
-                interaction.user.id,
-                expires_at.isoformat(),
-                -1 # 临时 message_id
-            ))
+                cursor.execute("""
+                    INSERT INTO pending_entries
+                    (entry_type, data_json, channel_id, guild_id, proposer_id, expires_at, message_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    'general_knowledge',
+                    data_json,
+                    interaction.channel_id,
+                    interaction.guild_id,
+                    interaction.user.id,
+                    expires_at.isoformat(),
+                    -1 # 临时 message_id
+                ))
             
-            pending_id = cursor.lastrowid
-            conn.commit()
-            log.info(f"已创建待审核条目 #{pending_id} (类型: general_knowledge)，提交者: {interaction.user.id}")
-            return pending_id
+                pending_id = cursor.lastrowid
+                conn.commit()
+                log.info(f"已创建待审核条目 #{pending_id} (类型: general_knowledge)，提交者: {interaction.user.id}")
+                return pending_id
             
-        except sqlite3.Error as e:
-            log.error(f"创建待审核条目时发生数据库错误: {e}", exc_info=True)
-            conn.rollback()
-            return None
-        finally:
-            conn.close()
+            except sqlite3.Error as e:
+                log.error(f"创建待审核条目时发生数据库错误: {e}", exc_info=True)
+                conn.rollback()
+                return None
 
     async def update_message_id_for_pending_entry(self, pending_id: int, message_id: int):
-        """更新待审核条目的 message_id"""
-        conn = self._get_world_book_connection()
-        if not conn:
-            return
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE pending_entries SET message_id = ? WHERE id = ?", (message_id, pending_id))
-            conn.commit()
-            log.info(f"已为待审核条目 #{pending_id} 更新 message_id 为 {message_id}")
-        except sqlite3.Error as e:
-            log.error(f"更新待审核条目的 message_id 时出错: {e}", exc_info=True)
-            conn.rollback()
-        finally:
-            conn.close()
+        """更新待审核条目的 message_id（在线程中执行，不阻塞事件循环）"""
+        await asyncio.to_thread(self._set_pending_entry_message_id, pending_id, message_id)
+
+    def _set_pending_entry_message_id(self, pending_id: int, message_id: int):
+        """update_message_id_for_pending_entry 的同步实现"""
+        with self._conn() as conn:
+            if not conn:
+                return
+
+            try:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE pending_entries SET message_id = ? WHERE id = ?", (message_id, pending_id))
+                conn.commit()
+                log.info(f"已为待审核条目 #{pending_id} 更新 message_id 为 {message_id}")
+            except sqlite3.Error as e:
+                log.error(f"更新待审核条目的 message_id 时出错: {e}", exc_info=True)
+                conn.rollback()
 
     async def on_submit(self, interaction: discord.Interaction):
         """当用户提交模态窗口时调用"""
@@ -252,48 +262,17 @@ class WorldBookContributionModal(discord.ui.Modal, title="贡献知识"):
         """开发者直接添加知识条目，无需审核"""
         responder = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
 
-        conn = self._get_world_book_connection()
-        if not conn:
-            await responder("❌ 数据库连接失败。", ephemeral=True)
+        # 数据库写入在线程中执行，不阻塞事件循环；状态默认即为 approved，名称与标题相同
+        entry_id = await asyncio.to_thread(
+            world_book_service.add_general_knowledge, title, title, content_text, category_name, interaction.user.id
+        )
+        if entry_id is None:
+            await responder("❌ 添加知识条目失败，请查看日志。", ephemeral=True)
             return
 
-        try:
-            cursor = conn.cursor()
+        log.info(f"开发者 {interaction.user.id} 已直接添加知识条目 '{title}' (ID: {entry_id})")
 
-            # 查找或创建类别
-            cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-            category_row = cursor.fetchone()
-            if category_row:
-                category_id = category_row[0]
-            else:
-                cursor.execute("INSERT INTO categories (name) VALUES (?)", (category_name,))
-                category_id = cursor.lastrowid
-                log.info(f"开发者 {interaction.user.id} 创建了新类别: {category_name}")
-
-            # 准备数据并插入
-            content_dict = {"description": content_text}
-            content_json = json.dumps(content_dict, ensure_ascii=False)
-            clean_title = re.sub(r'[^\w\u4e00-\u9fff]', '_', title)[:50]
-            import time
-            entry_id = f"{clean_title}_{int(time.time())}"
-
-            cursor.execute("""
-                INSERT INTO general_knowledge (id, title, name, content_json, category_id, contributor_id, status, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
-            """, (entry_id, title, title, content_json, category_id, interaction.user.id, 'approved'))
-            
-            conn.commit()
-            log.info(f"开发者 {interaction.user.id} 已直接添加知识条目 '{title}' (ID: {entry_id})")
-
-            # 异步触发RAG更新
-            asyncio.create_task(incremental_rag_service.process_general_knowledge(entry_id))
+        # 异步触发RAG更新
+        asyncio.create_task(incremental_rag_service.process_general_knowledge(entry_id))
 
-            await responder(f"✅ **开发者后门**: 知识条目 **{title}** 已成功添加，无需审核。", ephemeral=True)
-
-        except Exception as e:
-            log.error(f"开发者直接添加知识条目时出错: {e}", exc_info=True)
-            conn.rollback()
-            await responder(f"❌ 添加时发生内部错误: {e}", ephemeral=True)
-        finally:
-            conn.close()
-        
\ No newline at end of file
+        await responder(f"✅ **开发者后门**: 知识条目 **{title}** 已成功添加，无需审核。", ephemeral=True)
@@ -36,6 +36,9 @@ from src.chat.features.tools.services.tool_service import ToolService
 
 log = logging.getLogger(__name__)
 
+# 生成文本嵌入所用的模型，嵌入缓存的键也依赖它
+EMBEDDING_MODEL_NAME = "gemini-embedding-001"
+
 # --- 设置专门用于记录无效 API 密钥的 logger ---
 # 确保 data 目录存在
 if not os.path.exists("data"):
@@ -495,7 +498,10 @@ class GeminiService:
                             await self.key_rotation_service.release_key(
                                 key_obj.key, success=True
                             )
-                            if func.__name__ == "generate_embedding":
+                            if func.__name__ in (
+                                "generate_embedding",
+                                "generate_embeddings_batch",
+                            ):
                                 return None
                             return "呜哇，有点晕嘞，等我休息一会儿 <伤心>"
 
@@ -738,7 +744,7 @@ class GeminiService:
         embedding_result = await loop.run_in_executor(
             self.executor,
             lambda: client.models.embed_content(
-                model="gemini-embedding-001",
+                model=EMBEDDING_MODEL_NAME,
                 contents=[types.Part(text=text)],
                 config=embed_config,
             ),
@@ -748,6 +754,50 @@ class GeminiService:
             return embedding_result.embeddings[0].values
         return None
 
+    @_api_key_handler
+    async def generate_embeddings_batch(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document",
+        title: Optional[str] = None,
+        client: Any = None,
+    ) -> Optional[List[List[float]]]:
+        """
+        在一次请求中为多段文本批量生成嵌入向量（Gemini 的 batchEmbedContents 接口）。
+        返回的列表与 texts 一一对应；存在空文本或返回数量不符时返回 None。
+        """
+        if not client:
+            raise ValueError("装饰器未能提供客户端实例。")
+
+        if not texts or any(not text or not text.strip() for text in texts):
+            log.warning(
+                f"generate_embeddings_batch 接收到空文本！共 {len(texts)} 段, task_type: '{task_type}'"
+            )
+            return None
+
+        loop = asyncio.get_event_loop()
+        embed_config = types.EmbedContentConfig(task_type=task_type)
+        if title and task_type == "retrieval_document":
+            embed_config.title = title
+
+        # 每个 Part 对应一段独立的待嵌入内容，SDK 会将其合并为一次批量请求
+        embedding_result = await loop.run_in_executor(
+            self.executor,
+            lambda: client.models.embed_content(
+                model=EMBEDDING_MODEL_NAME,
+                contents=[types.Part(text=text) for text in texts],
+                config=embed_config,
+            ),
+        )
+
+        if (
+            embedding_result
+            and embedding_result.embeddings
+            and len(embedding_result.embeddings) == len(texts)
+        ):
+            return [embedding.values for embedding in embedding_result.embeddings]
+        return None
+
     @_api_key_handler
     async def generate_text(
         self,
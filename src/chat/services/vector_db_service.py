@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 
 import chromadb
+import numpy as np
 
 from src.chat.config import chat_config as config
 
@@ -14,13 +15,17 @@ class VectorDBService:
     封装与 ChromaDB 向量数据库交互的服务。
     """
     def __init__(self):
+        # 集合内容的版本号，每次写入或删除后递增，供上层缓存判断是否失效
+        self.version = 0
+        # 缓存的集合对象，避免每次读写都调用 get_or_create_collection 查询一次元数据库
+        self._collection = None
         try:
             # 初始化持久化客户端
             self.client = chromadb.PersistentClient(path=config.VECTOR_DB_PATH)
             self.collection_name = config.VECTOR_DB_COLLECTION_NAME
             
             # 启动时尝试获取或创建一次，以确保数据库连接正常
-            self.client.get_or_create_collection(name=self.collection_name)
+            self._collection = self.client.get_or_create_collection(name=self.collection_name)
             
             log.info(f"成功连接到 ChromaDB，将操作集合: '{self.collection_name}'")
         except Exception as e:
@@ -32,6 +37,12 @@ class VectorDBService:
         """检查服务是否可用"""
         return self.client is not None and self.collection_name is not None
 
+    def _get_collection(self):
+        """返回缓存的集合对象，缓存为空时（如重建或调用出错后）重新获取或创建。"""
+        if self._collection is None:
+            self._collection = self.client.get_or_create_collection(name=self.collection_name)
+        return self._collection
+
     def recreate_collection(self):
         """
         删除并重新创建集合，以确保数据完全同步。
@@ -42,6 +53,7 @@ class VectorDBService:
         
         try:
             log.info(f"正在删除旧的集合: '{config.VECTOR_DB_COLLECTION_NAME}'...")
+            self._collection = None
             self.client.delete_collection(name=config.VECTOR_DB_COLLECTION_NAME)
             log.info("旧集合已删除。")
         except Exception as e:
@@ -50,22 +62,22 @@ class VectorDBService:
 
         try:
             log.info(f"正在创建新的集合: '{config.VECTOR_DB_COLLECTION_NAME}'...")
-            # 创建后不需要立即赋值给 self.collection
-            self.client.create_collection(
+            self._collection = self.client.create_collection(
                 name=self.collection_name
             )
+            self.version += 1
             log.info("新集合已成功创建。")
         except Exception as e:
             log.error(f"创建新集合时出错: {e}", exc_info=True)
  
-    def add_documents(self, ids: List[str], documents: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]):
+    def add_documents(self, ids: List[str], documents: List[str], embeddings: Union[List[List[float]], np.ndarray], metadatas: List[Dict[str, Any]]):
         """
         向集合中添加或更新文档及其元数据。
 
         Args:
             ids: 文档的唯一ID列表。
             documents: 文档内容（文本）列表。
-            embeddings: 与文档对应的嵌入向量列表。
+            embeddings: 与文档对应的嵌入向量列表，或形状为 (文档数, 维度) 的 numpy 数组（推荐 float32）。
             metadatas: 与文档对应的元数据字典列表。
         """
         if not self.is_available():
@@ -73,8 +85,7 @@ class VectorDBService:
             return
 
         try:
-            # 在操作前获取最新的集合对象
-            collection = self.client.get_or_create_collection(name=self.collection_name)
+            collection = self._get_collection()
             # 使用 upsert 来添加新文档或更新现有文档，现在包含元数据
             collection.upsert(
                 ids=ids,
@@ -82,9 +93,12 @@ class VectorDBService:
                 documents=documents,
                 metadatas=metadatas
             )
+            self.version += 1
             log.info(f"成功向集合 '{collection.name}' 中添加/更新了 {len(ids)} 个文档。")
         except Exception as e:
             log.error(f"向 ChromaDB 添加文档时出错: {e}", exc_info=True)
+            # 集合可能已被其他进程（如 build_vector_index.py）重建，下次调用时重新获取
+            self._collection = None
 
     def delete_documents(self, ids: List[str]):
         """
@@ -102,12 +116,13 @@ class VectorDBService:
             return
 
         try:
-            # 在操作前获取最新的集合对象
-            collection = self.client.get_or_create_collection(name=self.collection_name)
+            collection = self._get_collection()
             collection.delete(ids=ids)
+            self.version += 1
             log.info(f"成功从集合 '{collection.name}' 中删除了 {len(ids)} 个文档。")
         except Exception as e:
             log.error(f"从 ChromaDB 删除文档时出错: {e}", exc_info=True)
+            self._collection = None
 
     def get_all_ids(self) -> List[str]:
         """获取集合中所有文档的ID。"""
@@ -115,14 +130,15 @@ class VectorDBService:
             log.error("VectorDB 服务不可用，无法获取ID。")
             return []
         try:
-            collection = self.client.get_or_create_collection(name=self.collection_name)
+            collection = self._get_collection()
             results = collection.get(include=[])
             return results.get('ids', [])
         except Exception as e:
             log.error(f"从 ChromaDB 获取所有ID时出错: {e}", exc_info=True)
+            self._collection = None
             return []
 
-    def search(self, query_embedding: List[float], n_results: int = 3, max_distance: float = 0.75) -> List[Dict[str, Any]]:
+    def search(self, query_embedding: List[float], n_results: int = 3, max_distance: float = 0.75, include_embeddings: bool = False) -> List[Dict[str, Any]]:
         """
         在集合中执行语义搜索，并根据距离阈值过滤结果。
 
@@ -130,6 +146,7 @@ class VectorDBService:
             query_embedding: 用于查询的嵌入向量。
             n_results: 要返回的最相似结果的数量。
             max_distance: 结果必须满足的最大距离。超过此距离的结果将被丢弃。
+            include_embeddings: 是否在每个结果中附带条目的嵌入向量（键为 'embedding'）。
 
         Returns:
             一个包含搜索结果的字典列表，每个字典包含 'id', 'content', 'distance', 和 'metadata'。
@@ -144,12 +161,14 @@ class VectorDBService:
             return []
 
         try:
-            # 在操作前获取最新的集合对象
-            collection = self.client.get_or_create_collection(name=self.collection_name)
+            collection = self._get_collection()
+            include = ["documents", "distances", "metadatas"] # 明确请求返回元数据
+            if include_embeddings:
+                include.append("embeddings")
             results = collection.query(
                 query_embeddings=[query_embedding],
                 n_results=n_results,
-                include=["documents", "distances", "metadatas"] # 明确请求返回元数据
+                include=include
             )
             
             # 解包并格式化结果
@@ -167,6 +186,9 @@ class VectorDBService:
                         "distance": distances[i],
                         "metadata": metadatas[i]
                     })
+                if include_embeddings:
+                    for result, embedding in zip(unfiltered_results, results['embeddings'][0]):
+                        result["embedding"] = embedding
             
             # 根据 max_distance 过滤结果
             filtered_results = [res for res in unfiltered_results if res['distance'] <= max_distance]
@@ -176,6 +198,7 @@ class VectorDBService:
             return filtered_results
         except Exception as e:
             log.error(f"在 ChromaDB 中搜索时出错: {e}", exc_info=True)
+            self._collection = None
             return []
 
 # 全局实例
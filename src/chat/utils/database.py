@@ -828,6 +828,19 @@ class ChatDatabaseManager:
                 return None
             raise
 
+    async def get_personal_summaries(
+        self, user_ids: List[int]
+    ) -> Dict[int, Optional[str]]:
+        """批量获取多位用户的个人记忆摘要，返回 {user_id: personal_summary}。"""
+        if not user_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in user_ids)
+        query = f"SELECT user_id, personal_summary FROM users WHERE user_id IN ({placeholders})"
+        rows = await self._execute(
+            self._db_transaction, query, tuple(user_ids), fetch="all"
+        )
+        return {row["user_id"]: row["personal_summary"] for row in rows}
+
     async def update_personal_summary(self, user_id: int, summary: str) -> None:
         """更新用户的个人记忆摘要。"""
         query = "UPDATE users SET personal_summary = ? WHERE user_id = ?"
@@ -840,6 +853,51 @@ class ChatDatabaseManager:
             log.error(f"更新用户 {user_id} 的个人记忆摘要失败: {e}")
             raise
 
+    async def upsert_unlock_personal_memory(self, user_id: int) -> None:
+        """为用户解锁个人记忆功能，用户记录不存在时一并创建。"""
+        query = """
+            INSERT INTO users (user_id, has_personal_memory) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET has_personal_memory = 1
+        """
+        await self._execute(self._db_transaction, query, (user_id,), commit=True)
+
+    async def save_personal_summary_and_reset_count(
+        self, user_id: int, guild_id: int, summary: str
+    ) -> None:
+        """在同一个事务中保存新的个人记忆摘要并重置对应的个人消息计数器。"""
+
+        def _transaction():
+            conn = None
+            try:
+                conn = sqlite3.connect(self.db_path)
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE users SET personal_summary = ? WHERE user_id = ?",
+                    (summary, user_id),
+                )
+                cursor.execute(
+                    """
+                    UPDATE ai_conversation_contexts
+                    SET personal_message_count = 0
+                    WHERE user_id = ? AND guild_id = ?
+                """,
+                    (user_id, guild_id),
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                if conn:
+                    conn.rollback()
+                log.error(f"保存用户 {user_id} 的个人记忆摘要并重置计数失败: {e}")
+                raise
+            finally:
+                if conn:
+                    conn.close()
+
+        await self._execute(_transaction)
+        log.info(
+            f"已更新用户 {user_id} 的个人记忆摘要并重置 guild_id {guild_id} 的消息计数。"
+        )
+
     # --- 聊天设置管理 ---
 
     async def get_global_chat_config(self, guild_id: int) -> Optional[sqlite3.Row]:
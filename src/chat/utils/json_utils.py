@@ -0,0 +1,25 @@
+import json
+from typing import Any
+
+try:
+    # orjson 随 discord.py[speed] 一同安装，缺失时退回标准库
+    import orjson
+except ImportError:
+    orjson = None
+
+# 复用同一个编码器，避免每次调用 json.dumps(ensure_ascii=False) 时重新构造
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def dumps(obj: Any) -> str:
+    """将对象序列化为 JSON 字符串，非 ASCII 字符（如中文）保持原样。"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return _ENCODER.encode(obj)
+
+
+def loads(data: str) -> Any:
+    """将 JSON 字符串反序列化为 Python 对象。"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from src.chat.config.prompts import SYSTEM_PROMPT
 from src.chat.config.emoji_config import EMOJI_MAPPINGS, FACTION_EMOJI_MAPPINGS
 from src.chat.services.event_service import event_service
@@ -13,6 +14,10 @@ def replace_emojis(text: str) -> str:
     将文本中的自定义表情占位符（如 <微笑>）替换为对应的 Discord 自定义表情（如 <:xianhua:12345>）。
     此函数现在会根据当前活动和派系动态选择表情包。
     """
+    # 所有占位符都形如 <xxx>，不含 "<" 的文本（绝大多数回复）无需任何正则扫描
+    if "<" not in text:
+        return text
+
     active_event = event_service.get_active_event()
     selected_faction = event_service.get_selected_faction()
 
@@ -27,12 +32,50 @@ def replace_emojis(text: str) -> str:
             )
             emoji_map_to_use = faction_map
 
-    for pattern, replacement_list in emoji_map_to_use:
+    combined_pattern, replacements = _get_combined_emoji_pattern(emoji_map_to_use)
+    if combined_pattern is None:
+        return text
+    return combined_pattern.sub(lambda m: replacements[m.lastindex - 1], text)
+
+
+# 按映射表缓存合并后的正则，映射表均为模块级常量，以 id 作为键即可
+_combined_emoji_patterns = {}
+
+
+def _get_combined_emoji_pattern(emoji_map):
+    """
+    将映射表中的所有占位符正则合并为一个带分组的交替正则，
+    使替换只需对文本做一次扫描，再按命中的分组序号查表得到替换内容。
+    """
+    cached = _combined_emoji_patterns.get(id(emoji_map))
+    if cached is not None:
+        return cached
+
+    alternatives = []
+    replacements = []
+    for pattern, replacement_list in emoji_map:
         if replacement_list:
             # 替换内容必须是字符串，因此我们从列表中取出第一个元素
             # 注意：对于空字符串 '' 的情况，这里会正确地移除占位符
-            text = pattern.sub(replacement_list[0], text)
-    return text
+            alternatives.append(f"({pattern.pattern})")
+            replacements.append(replacement_list[0])
+
+    combined = re.compile("|".join(alternatives)) if alternatives else None
+    cached = (combined, replacements)
+    _combined_emoji_patterns[id(emoji_map)] = cached
+    return cached
+
+
+def truncate_utf8(text: str, max_bytes: int, suffix: str = "...") -> str:
+    """
+    按 UTF-8 字节数截断文本，并保证不会截断在多字节字符中间。
+    字节数比字符数更接近模型的 token 消耗：中文约 3 字节/字符、约 1 token，
+    英文约 1 字节/字符、约 4 字符/token，按字节截断可以让两者得到相近的 token 预算。
+    """
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", "ignore") + suffix
 
 
 def extract_persona_prompt(system_prompt: str) -> str:
@@ -59,6 +102,7 @@ def get_core_persona() -> str:
     return get_thread_commentor_persona()
 
 
+@lru_cache(maxsize=1)
 def get_thread_commentor_persona() -> str:
     """
     为暖贴功能，从 SYSTEM_PROMPT 中提取特定的、精简的人设信息。
@@ -67,6 +111,7 @@ def get_thread_commentor_persona() -> str:
     - <core_identity>
     - <markdown_guidelines>
     - <emoji_guidelines>
+    SYSTEM_PROMPT 在运行期间不会变化，因此结果只需计算一次。
     """
     # 提取 <core_identity>
     core_identity_match = re.search(
@@ -0,0 +1,72 @@
+import logging
+import queue
+import sqlite3
+from typing import Dict
+
+log = logging.getLogger(__name__)
+
+# 每个数据库文件最多保留的空闲连接数
+SQLITE_POOL_MAXSIZE = 8
+# 每个连接的页缓存大小（KiB）与内存映射读取的上限（字节）
+SQLITE_POOL_CACHE_SIZE_KIB = 20000
+SQLITE_POOL_MMAP_SIZE = 256 * 1024 * 1024
+# 数据库被其他连接锁定时的最长等待时间（秒），超时才抛出 database is locked
+SQLITE_POOL_BUSY_TIMEOUT_SECONDS = 5.0
+
+
+class SQLiteConnectionPool:
+    """
+    同步 sqlite3 连接的简单连接池。
+    连接在进程生命周期内保持打开，避免每次查询都重新打开数据库文件及其 WAL/SHM 文件。
+    acquire 从不阻塞：没有空闲连接时直接新建，归还时空闲连接已满则关闭。
+    """
+
+    def __init__(self, db_path: str, maxsize: int = SQLITE_POOL_MAXSIZE):
+        self.db_path = db_path
+        # 后进先出，优先复用最近用过、页缓存最热的连接
+        self._idle = queue.LifoQueue(maxsize=maxsize)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_POOL_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL 模式是持久化的，这里再确认一次，保证下面的 NORMAL 同步级别始终在 WAL 下使用
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_POOL_CACHE_SIZE_KIB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_POOL_MMAP_SIZE}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """取出一个空闲连接，没有时新建一个。"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接；未结束的事务会被回滚，避免把锁带给下一个使用者。"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error) as e:
+            if isinstance(e, sqlite3.Error):
+                log.warning(f"归还 SQLite 连接时出错，将直接关闭: {e}")
+            conn.close()
+
+
+# 按数据库文件路径共享的连接池
+_pools: Dict[str, SQLiteConnectionPool] = {}
+
+
+def get_pool(db_path: str) -> SQLiteConnectionPool:
+    """返回指定数据库文件的共享连接池，首次调用时创建。"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        pool = _pools[db_path] = SQLiteConnectionPool(db_path)
+    return pool
@@ -344,6 +344,7 @@ async def main():
         # 在机器人关闭时，确保数据库连接被关闭
         await guidance_db_manager.close()
         await chat_db_manager.close()
+        await get_user_avatar.close_session()
         log.info("机器人已下线，数据库连接已关闭。")
 
 
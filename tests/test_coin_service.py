@@ -141,11 +141,12 @@ class TestCoinService(unittest.TestCase):
                     # 模拟加款（回滚）
                     with patch.object(self.coin_service, 'add_coins', new_callable=AsyncMock) as mock_add_coins:
                         
-                        success, msg, new_balance = self._run_async(self.coin_service.purchase_item(user_id, guild_id, item_id))
+                        outcome = self._run_async(self.coin_service.purchase_item(user_id, guild_id, item_id))
 
-                        self.assertFalse(success)
-                        self.assertIn("已经送过", msg)
-                        self.assertEqual(new_balance, 200) # 余额应恢复原状
+                        self.assertFalse(outcome.success)
+                        self.assertIn("已经送过", outcome.message)
+                        self.assertEqual(outcome.new_balance, 200) # 余额应恢复原状
+                        self.assertFalse(outcome.generate_gift)
                         
                         # 验证扣款和加款都被调用了
                         mock_remove_coins.assert_called_once_with(user_id, 120, "购买 1x 泰迪熊")
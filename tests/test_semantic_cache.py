@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+测试 RAG 查询语义缓存 (SemanticCache)
+"""
+
+import numpy as np
+
+from src.chat.features.world_book.services.world_book_service import (
+    RecentSearchCache,
+    SemanticCache,
+)
+
+
+def _random_vector(rng, dim=64):
+    return rng.standard_normal(dim).astype(np.float32).tolist()
+
+
+def test_near_duplicate_query_hits_cache():
+    """与已缓存查询高度相似的查询应直接复用其结果"""
+    rng = np.random.default_rng(1)
+    cache = SemanticCache()
+    query = _random_vector(rng)
+    results = [{"id": "a", "distance": 0.1}]
+    cache.put(query, results)
+
+    near_duplicate = (np.asarray(query) * 1.01 + 0.001).tolist()
+    assert cache.get(near_duplicate) is results
+
+
+def test_unrelated_query_misses_cache():
+    """不相关的查询不应命中缓存"""
+    rng = np.random.default_rng(2)
+    cache = SemanticCache()
+    cache.put(_random_vector(rng), [{"id": "a", "distance": 0.1}])
+
+    assert cache.get(_random_vector(rng)) is None
+
+
+def test_expired_and_evicted_entries():
+    """过期条目不再命中，超出容量时最早的条目被淘汰"""
+    rng = np.random.default_rng(3)
+    expired_cache = SemanticCache(ttl=0)
+    query = _random_vector(rng)
+    expired_cache.put(query, [])
+    assert expired_cache.get(query) is None
+
+    small_cache = SemanticCache(maxsize=2)
+    queries = [_random_vector(rng) for _ in range(3)]
+    for i, q in enumerate(queries):
+        small_cache.put(q, [{"id": str(i), "distance": 0.1}])
+    assert small_cache.get(queries[0]) is None
+    assert small_cache.get(queries[2])[0]["id"] == "2"
+
+    small_cache.clear()
+    assert small_cache.get(queries[2]) is None
+
+
+def test_recent_search_reranks_cached_candidates():
+    """与最近搜索相似的查询应在其候选集内按平方 L2 距离重新排序，不相关的查询不命中"""
+    rng = np.random.default_rng(4)
+    entries = rng.standard_normal((5, 64)).astype(np.float32)
+    query = np.asarray(_random_vector(rng))
+    results = [{"id": str(i), "distance": 0.0} for i in range(5)]
+    cache = RecentSearchCache()
+    cache.put(query.tolist(), results, entries.tolist())
+
+    nearby = query + 0.01 * rng.standard_normal(64)
+    reranked = cache.rerank(nearby.tolist(), 5, float("inf"))
+    expected = ((entries - nearby) ** 2).sum(axis=1)
+    assert [r["id"] for r in reranked] == [str(i) for i in np.argsort(expected)]
+    assert np.isclose(reranked[0]["distance"], expected.min(), rtol=1e-4)
+    assert results[0]["distance"] == 0.0
+
+    assert cache.rerank(_random_vector(rng), 5, float("inf")) is None
+    cache.clear()
+    assert cache.rerank(nearby.tolist(), 5, float("inf")) is None
+
+
+def test_recent_search_falls_back_when_too_few_candidates_pass():
+    """候选集中满足距离阈值的结果不足 n_results 时应返回 None，由调用方执行完整搜索"""
+    rng = np.random.default_rng(5)
+    entries = rng.standard_normal((5, 64)).astype(np.float32)
+    query = np.asarray(_random_vector(rng))
+    cache = RecentSearchCache()
+    cache.put(query.tolist(), [{"id": str(i), "distance": 0.0} for i in range(5)], entries.tolist())
+
+    nearby = query + 0.01 * rng.standard_normal(64)
+    distances = np.sort(((entries - nearby) ** 2).sum(axis=1))
+    # 阈值只放过前两个候选
+    max_distance = float((distances[1] + distances[2]) / 2)
+    assert [r["distance"] <= max_distance for r in cache.rerank(nearby.tolist(), 2, max_distance)] == [True, True]
+    assert cache.rerank(nearby.tolist(), 3, max_distance) is None
+    # 最佳距离也超过阈值
+    assert cache.rerank(nearby.tolist(), 1, float(distances[0]) / 2) is None